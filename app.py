@@ -3,7 +3,12 @@ California Procurement Assistant - Streamlit Interface
 """
 import streamlit as st
 from pymongo import MongoClient
-from config import MONGODB_CONFIG
+from config import MONGODB_CONFIG, PREWARM_CONFIG, EXAMPLE_QUESTIONS, CHAT_CONFIG, EXPORT_CONFIG
+from prewarm import CachePrewarmer
+from partitions import source_collections
+from demo_questions import demo_questions
+from exporter import EXPORT_FORMATS, write_export_file, remove_stale_exports
+from chat_history import ChatHistory
 import time
 import os
 from dotenv import load_dotenv
@@ -27,34 +32,45 @@ st.set_page_config(
     layout="wide"
 )
 
+@st.cache_resource
+def load_agent():
+    """Create one shared agent per server process and start cache pre-warming"""
+    agent = GPTAgent()
+    if PREWARM_CONFIG['enabled']:
+        CachePrewarmer(agent, EXAMPLE_QUESTIONS + demo_questions).start()
+    return agent
+
 # Initialize session state
 if 'agent' not in st.session_state and agent_available:
     try:
-        st.session_state.agent = GPTAgent()
+        st.session_state.agent = load_agent()
     except Exception as e:
         st.error(f"Error initializing agent: {e}")
         st.stop()
     
-if 'messages' not in st.session_state:
-    st.session_state.messages = []
+if 'history' not in st.session_state:
+    st.session_state.history = ChatHistory(
+        CHAT_CONFIG['visible_messages'],
+        CHAT_CONFIG['max_messages']
+    )
 
 def get_stats():
     """Get database statistics"""
     try:
         client = MongoClient(MONGODB_CONFIG['host'], MONGODB_CONFIG['port'])
         db = client[MONGODB_CONFIG['database']]
-        collection = db[MONGODB_CONFIG['collection']]
+        collections = source_collections(db)
         
         stats = {
-            'records': collection.count_documents({}),
-            'departments': len(collection.distinct('Department Name')),
-            'suppliers': len(collection.distinct('Supplier Name'))
+            'records': sum(c.count_documents({}) for c in collections),
+            'departments': len(set().union(*(c.distinct('Department Name') for c in collections))),
+            'suppliers': len(set().union(*(c.distinct('Supplier Name') for c in collections)))
         }
         
         pipeline = [{'$group': {'_id': None, 'total': {'$sum': '$Total Price'}}}]
-        result = list(collection.aggregate(pipeline))
-        if result:
-            stats['spending'] = result[0]['total']
+        totals = [r['total'] for c in collections for r in c.aggregate(pipeline)]
+        if totals:
+            stats['spending'] = sum(totals)
         
         client.close()
         return stats
@@ -62,6 +78,28 @@ def get_stats():
         st.error(f"Database connection error: {e}")
         return None
 
+def prepare_export(question, fmt):
+    """Write an export chunk by chunk under the static folder, replacing this session's last one"""
+    directory = EXPORT_CONFIG['directory']
+    remove_stale_exports(directory, EXPORT_CONFIG['max_age'])
+    previous = st.session_state.pop('export', None)
+    if previous:
+        path = os.path.join(directory, previous['name'])
+        if os.path.exists(path):
+            os.remove(path)
+    
+    with st.spinner("Exporting all matching rows..."):
+        name = write_export_file(st.session_state.agent.export_query(question, fmt), directory, fmt)
+    st.session_state.export = {'name': name, 'format': fmt}
+
+def export_download_link(export):
+    """Link to the export file; Streamlit streams it from disk so the app never holds it in memory"""
+    href = f"{EXPORT_CONFIG['url_path']}/{export['name']}"
+    st.markdown(
+        f'<a href="{href}" download="procurement_export.{export["format"]}">⬇️ Download</a>',
+        unsafe_allow_html=True
+    )
+
 # Main title
 st.title("🏛️ California Procurement AI Assistant")
 st.markdown(f"Ask questions about procurement data (Using {agent_type})")
@@ -84,61 +122,90 @@ with st.sidebar:
     
     st.header("💡 Example Questions")
     
-    examples = [
-        "What is the total spending in 2014?",
-        "Which department spent the most?",
-        "Top 5 suppliers by revenue",
-        "Average purchase amount",
-        "How many purchases in 2015?",
-        "Most frequently ordered items",
-        "Show purchases over $1 million"
-    ]
-    
-    for ex in examples:
+    for ex in EXAMPLE_QUESTIONS:
         if st.button(ex, key=ex):
-            st.session_state.messages.append({"role": "user", "content": ex})
+            st.session_state.agent.log_question(ex)
+            st.session_state.history.append("user", ex)
             with st.spinner("Processing..."):
                 response = st.session_state.agent.answer_question(ex)
-            st.session_state.messages.append({"role": "assistant", "content": response})
+            st.session_state.history.append("assistant", response)
             st.rerun()
     
     st.divider()
     
+    st.header("📥 Export Results")
+    
+    user_questions = st.session_state.history.user_questions()
+    export_question = st.text_input(
+        "Question to export",
+        value=user_questions[-1] if user_questions else "",
+        key="export_question"
+    )
+    export_format = st.selectbox("Format", list(EXPORT_FORMATS), key="export_format")
+    
+    if st.button("Prepare export") and export_question:
+        try:
+            prepare_export(export_question, export_format)
+        except Exception as e:
+            st.error(f"Export failed: {e}")
+    
+    export = st.session_state.get('export')
+    if export and os.path.exists(os.path.join(EXPORT_CONFIG['directory'], export['name'])):
+        export_download_link(export)
+    
+    st.divider()
+    
     if st.button("🗑️ Clear Chat"):
-        st.session_state.messages = []
+        st.session_state.history.clear()
         st.rerun()
 
 # Chat area
 st.header("💬 Chat")
 
-# Display previous messages
-for message in st.session_state.messages:
+# Older turns stay collapsed and are only rendered on request
+history = st.session_state.history
+if history.archived_count:
+    if st.toggle(f"Show {history.archived_count} earlier messages", key="show_archive"):
+        st.markdown(history.archive_markdown())
+        st.divider()
+
+# Display recent messages
+for message in history.recent():
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
 
 # User input
 if prompt := st.chat_input("Ask about procurement data..."):
-    st.session_state.messages.append({"role": "user", "content": prompt})
+    st.session_state.agent.log_question(prompt)
+    st.session_state.history.append("user", prompt)
     
     with st.chat_message("user"):
         st.markdown(prompt)
     
     with st.chat_message("assistant"):
-        with st.spinner("Thinking..."):
-            start_time = time.time()
-            try:
-                response = st.session_state.agent.answer_question(prompt)
-                elapsed = time.time() - start_time
-                
-                st.markdown(response)
-                st.caption(f"Response time: {elapsed:.1f}s")
-                
-                st.session_state.messages.append({"role": "assistant", "content": response})
-                
-            except Exception as e:
-                error_msg = f"Error: {e}"
-                st.error(error_msg)
-                st.info("Try rephrasing your question or use a simpler query.")
+        placeholder = st.empty()
+        placeholder.markdown("Thinking...")
+        start_time = time.time()
+        try:
+            # Render the answer incrementally as rows arrive from the cursor
+            response = ""
+            first_chunk_time = None
+            for chunk in st.session_state.agent.answer_question_stream(prompt):
+                if first_chunk_time is None:
+                    first_chunk_time = time.time() - start_time
+                response += chunk
+                placeholder.markdown(response)
+            elapsed = time.time() - start_time
+            
+            st.caption(f"Response time: {elapsed:.1f}s (first result after {first_chunk_time or elapsed:.1f}s)")
+            
+            st.session_state.history.append("assistant", response)
+            
+        except Exception as e:
+            error_msg = f"Error: {e}"
+            placeholder.empty()
+            st.error(error_msg)
+            st.info("Try rephrasing your question or use a simpler query.")
 
 # About section
 with st.expander("ℹ️ About"):
@@ -0,0 +1,54 @@
+"""
+Micro-benchmark for question parsing and pipeline planning
+Run this file to measure parse-plus-plan cost per question (no database needed)
+"""
+
+from ollama_agent import OllamaAgent
+import time
+
+questions = [
+    "What is the total spending in 2014?",
+    "How many purchases were made in 2013?",
+    "What's the average purchase amount?",
+    "Which department spent the most money?",
+    "Top 5 suppliers by revenue",
+    "Most frequently ordered items",
+    "What are the top selling products?",
+    "What's the highest spending quarter?",
+    "Show monthly spending trend",
+    "Compare spending between 2013 and 2014",
+    "Show purchases over 1 million dollars",
+    "Find the 10 most expensive purchases",
+    "What acquisition methods are most popular?",
+    "Show spending trend over time",
+]
+
+ROUNDS = 2000
+
+def time_per_question(func):
+    """Average microseconds per question over all rounds"""
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        for question in questions:
+            func(question)
+    elapsed = time.perf_counter() - start
+    return elapsed / (ROUNDS * len(questions)) * 1e6
+
+if __name__ == "__main__":
+    agent = OllamaAgent()
+
+    def parse_only(question):
+        return agent.understand_query(question)
+
+    def parse_and_plan(question):
+        return agent.generate_mongodb_query(agent.understand_query(question))
+
+    def cached_plan(question):
+        return agent.plan_query(question)
+
+    print("="*60)
+    print(f"Parse + plan benchmark ({len(questions)} questions x {ROUNDS} rounds)")
+    print("="*60)
+    print(f"Parse only:          {time_per_question(parse_only):8.2f} us/question")
+    print(f"Parse + plan:        {time_per_question(parse_and_plan):8.2f} us/question")
+    print(f"Plan cache (warm):   {time_per_question(cached_plan):8.2f} us/question")
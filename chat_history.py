@@ -0,0 +1,70 @@
+"""
+Chat History - Bounded chat transcript with a collapsed archive and cached rendering
+"""
+from collections import deque
+from itertools import islice
+
+ROLE_LABELS = {
+    'user': "🧑 **You:**",
+    'assistant': "🏛️ **Assistant:**"
+}
+
+
+class ChatHistory:
+    def __init__(self, visible_messages, max_messages):
+        self.visible_messages = visible_messages
+        self.messages = deque(maxlen=max_messages)
+        self.next_id = 0
+        self.rendered = {}
+        self.archive_cache = (None, "")
+
+    def append(self, role, content):
+        """Add a message; the oldest ones fall off once max_messages is reached"""
+        if len(self.messages) == self.messages.maxlen:
+            dropped = self.messages[0]
+            self.rendered.pop(dropped['id'], None)
+        self.messages.append({'id': self.next_id, 'role': role, 'content': content})
+        self.next_id += 1
+
+    def clear(self):
+        self.messages.clear()
+        self.rendered.clear()
+        self.archive_cache = (None, "")
+
+    def __len__(self):
+        return len(self.messages)
+
+    @property
+    def archived_count(self):
+        return max(0, len(self.messages) - self.visible_messages)
+
+    def recent(self):
+        """Messages shown as individual chat bubbles"""
+        return list(islice(self.messages, self.archived_count, None))
+
+    def archived(self):
+        """Older messages kept behind the archive toggle"""
+        return list(islice(self.messages, 0, self.archived_count))
+
+    def user_questions(self):
+        return [m['content'] for m in self.messages if m['role'] == 'user']
+
+    def render(self, message):
+        """Markdown for one archived message, built once per message"""
+        markdown = self.rendered.get(message['id'])
+        if markdown is None:
+            # Blank line so headings and lists in the content still render as markdown
+            markdown = f"{ROLE_LABELS.get(message['role'], message['role'])}\n\n{message['content']}"
+            self.rendered[message['id']] = markdown
+        return markdown
+
+    def archive_markdown(self):
+        """All archived messages as one markdown block, rebuilt only when the archive changes"""
+        archived = self.archived()
+        if not archived:
+            return ""
+        key = (archived[0]['id'], archived[-1]['id'])
+        if self.archive_cache[0] != key:
+            body = "\n\n---\n\n".join(self.render(m) for m in archived)
+            self.archive_cache = (key, body)
+        return self.archive_cache[1]
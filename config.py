@@ -1,6 +1,10 @@
 """
 Configuration settings for California Procurement Assistant
 """
+import os
+
+# Project directory, so data paths don't depend on the working directory
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 # MongoDB configuration
 MONGODB_CONFIG = {
@@ -8,7 +12,79 @@ MONGODB_CONFIG = {
 
     'port': 27017,
     'database': 'procurement_db',
-    'collection': 'purchases'
+    'collection': 'purchases',
+    'metadata_collection': 'metadata',
+    'query_log_collection': 'query_log',
+    'sketch_collection': 'price_sketches',
+    'partitioned': False,  # one collection per Fiscal Year instead of a single collection
+    'partition_prefix': 'purchases_fy_',
+    'fanout_workers': 4
+}
+
+# Ollama configuration
+OLLAMA_CONFIG = {
+    'url': 'http://localhost:11434/api/generate',
+    'model': 'mistral',
+    'connect_timeout': 2,
+    'read_timeout': 20,
+    'pool_size': 4
+}
+
+# Cache sizes (number of entries)
+CACHE_CONFIG = {
+    'plan_cache_size': 1024,
+    'llm_plan_cache_size': 512,
+    'answer_cache_size': 256,
+    'version_check_interval': 30  # seconds between data reload checks
+}
+
+# Streaming settings
+STREAM_CONFIG = {
+    'batch_size': 10
+}
+
+# Price sketches for percentile / histogram questions
+SKETCH_CONFIG = {
+    'compression': 200  # t-digest compression; higher is more accurate and larger
+}
+
+# Spend cube (aggregate lattice) built by data_loader.py
+CUBE_CONFIG = {
+    'path': os.path.join(BASE_DIR, 'data', 'spend_cube.npz'),
+    'max_cells': 100000  # larger cuboids are rolled up from an ancestor at query time
+}
+
+# Cache pre-warming (runs in a background thread of the Streamlit app)
+PREWARM_CONFIG = {
+    'enabled': True,
+    'top_logged_questions': 10,
+    'check_interval': 60  # seconds between data reload checks
+}
+
+# Questions shown in the sidebar; also pre-warmed at startup
+EXAMPLE_QUESTIONS = [
+    "What is the total spending in 2014?",
+    "Which department spent the most?",
+    "Top 5 suppliers by revenue",
+    "Average purchase amount",
+    "How many purchases in 2015?",
+    "Most frequently ordered items",
+    "Show purchases over $1 million"
+]
+
+# Result export settings
+EXPORT_CONFIG = {
+    'chunk_size': 5000,  # rows per CSV chunk / Parquet row group
+    # Exports are written under Streamlit's static folder and streamed from disk on download
+    'directory': os.path.join(BASE_DIR, 'static', 'exports'),
+    'url_path': 'app/static/exports',
+    'max_age': 3600  # seconds before an export file is removed
+}
+
+# Chat history retention
+CHAT_CONFIG = {
+    'visible_messages': 20,  # recent messages rendered as chat bubbles
+    'max_messages': 200  # older messages beyond this are dropped
 }
 
 # Application settings
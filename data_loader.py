@@ -5,7 +5,11 @@ Data Loader - Imports CSV data into MongoDB
 import pandas as pd
 from pymongo import MongoClient
 import os
-from config import MONGODB_CONFIG
+from datetime import datetime
+from config import MONGODB_CONFIG, CUBE_CONFIG
+from partitions import partition_name, partition_collections, source_collections
+from sketches import build_price_sketches
+from spend_cube import SpendCube
 
 print("="*50)
 print("Data Loader - Starting...")
@@ -104,28 +108,44 @@ print("\n5. Loading to MongoDB...")
 print("   This may take 1-2 minutes...")
 
 try:
-    # Delete old data
-    old_count = collection.count_documents({})
-    if old_count > 0:
-        print(f"   Deleting {old_count:,} old records...")
-        collection.delete_many({})
-    
-    # Convert to dictionary
-    records = df.to_dict('records')
+    if MONGODB_CONFIG['partitioned']:
+        # One collection per fiscal year; drop old partitions first
+        for old_partition in partition_collections(db).values():
+            print(f"   Dropping old partition {old_partition.name}...")
+            old_partition.drop()
+        targets = [
+            (db[partition_name(fiscal_year)], frame)
+            for fiscal_year, frame in df.groupby('Fiscal Year', dropna=False)
+        ]
+    else:
+        # Delete old data
+        old_count = collection.count_documents({})
+        if old_count > 0:
+            print(f"   Deleting {old_count:,} old records...")
+            collection.delete_many({})
+        targets = [(collection, df)]
     
-    # Insert in batches
-    batch_size = 5000
-    total = len(records)
+    total = len(df)
     inserted = 0
     
-    for i in range(0, total, batch_size):
-        batch = records[i:i+batch_size]
-        collection.insert_many(batch)
-        inserted += len(batch)
+    for target, frame in targets:
+        if len(targets) > 1:
+            print(f"   Writing {len(frame):,} records to {target.name}")
+        
+        # Convert to dictionary
+        records = frame.to_dict('records')
         
-        # Show progress
-        percent = (inserted / total) * 100
-        print(f"   Progress: {inserted:,}/{total:,} ({percent:.0f}%)")
+        # Insert in batches
+        batch_size = 5000
+        
+        for i in range(0, len(records), batch_size):
+            batch = records[i:i+batch_size]
+            target.insert_many(batch)
+            inserted += len(batch)
+            
+            # Show progress
+            percent = (inserted / total) * 100
+            print(f"   Progress: {inserted:,}/{total:,} ({percent:.0f}%)")
     
     print(f"   Complete! Inserted {inserted:,} records")
     
@@ -133,30 +153,83 @@ except Exception as e:
     print(f"   ERROR: {e}")
     exit()
 
+# Precompute price sketches for percentile / histogram questions
+print("\n6. Building price sketches...")
+
+try:
+    sketches = db[MONGODB_CONFIG['sketch_collection']]
+    sketches.drop()
+    
+    batch = []
+    built = 0
+    for doc in build_price_sketches(df):
+        batch.append(doc)
+        if len(batch) >= 5000:
+            sketches.insert_many(batch)
+            built += len(batch)
+            batch = []
+    if batch:
+        sketches.insert_many(batch)
+        built += len(batch)
+    
+    sketches.create_index([('dimension', 1), ('fiscal_year', 1), ('key', 1)])
+    print(f"   Complete! Stored {built:,} sketches")
+    
+except Exception as e:
+    print(f"   ERROR: {e}")
+    print("   Percentile questions will be answered exactly instead")
+
+# Build the spend cube for breakdown / drill-down questions
+print("\n7. Building spend cube...")
+
+try:
+    cube = SpendCube.build(df)
+    cube.save(CUBE_CONFIG['path'])
+    cells = sum(len(cuboid['sum']) for cuboid in cube.cuboids.values())
+    print(f"   Complete! Stored {len(cube.cuboids)} cuboids ({cells:,} cells) in {CUBE_CONFIG['path']}")
+    
+except Exception as e:
+    print(f"   ERROR: {e}")
+    print("   Breakdown questions will be answered from the database instead")
+
 # Verify data
-print("\n6. Verifying data...")
+print("\n8. Verifying data...")
+
+collections = source_collections(db)
 
-count = collection.count_documents({})
+count = sum(c.count_documents({}) for c in collections)
 print(f"   Total records: {count:,}")
 
-depts = len(collection.distinct('Department Name'))
+depts = len(set().union(*(c.distinct('Department Name') for c in collections)))
 print(f"   Departments: {depts}")
 
-suppliers = len(collection.distinct('Supplier Name'))
+suppliers = len(set().union(*(c.distinct('Supplier Name') for c in collections)))
 print(f"   Suppliers: {suppliers}")
 
 # Calculate total spending
 pipeline = [
     {'$group': {
         '_id': None,
-        'total': {'$sum': '$Total Price'},
-        'avg': {'$avg': '$Total Price'}
+        'total': {'$sum': '$Total Price'}
     }}
 ]
-result = list(collection.aggregate(pipeline))
-if result:
-    print(f"   Total spending: ${result[0]['total']:,.2f}")
-    print(f"   Average order: ${result[0]['avg']:,.2f}")
+total_spending = 0
+for c in collections:
+    result = list(c.aggregate(pipeline))
+    if result:
+        total_spending += result[0]['total']
+if count:
+    print(f"   Total spending: ${total_spending:,.2f}")
+    print(f"   Average order: ${total_spending / count:,.2f}")
+
+# Stamp the data version so running apps refresh their caches
+metadata = db[MONGODB_CONFIG['metadata_collection']]
+metadata.replace_one(
+    {'_id': 'data_version'},
+    {'_id': 'data_version', 'loaded_at': datetime.now(), 'records': count},
+    upsert=True
+)
+print(f"   Data version updated")
 
 print("\n" + "="*50)
 print("SUCCESS! Data is ready to use")
@@ -6,12 +6,6 @@ Run this file to test various query types
 from ollama_agent import OllamaAgent
 import time
 
-# Initialize agent
-print("Initializing agent...")
-agent = OllamaAgent()
-print("Agent ready!\n")
-print("="*60)
-
 # Test questions covering all functionality
 demo_questions = [
     # Basic Statistics
@@ -47,9 +41,18 @@ demo_questions = [
     # Trend Analysis
     "Show spending trend over time",
     "What's the yearly spending analysis?",
+    
+    # Distribution Analysis
+    "What is the median purchase amount?",
+    "95th percentile order in Health",
+    "Show the distribution of purchase amounts",
+    
+    # Spend Breakdowns
+    "Break down spending by department and fiscal quarter in 2014",
+    "Drill down into Health spending by supplier",
 ]
 
-def test_questions():
+def test_questions(agent):
     """Test all demo questions"""
     for i, question in enumerate(demo_questions, 1):
         print(f"\n{i}. Question: {question}")
@@ -78,7 +81,13 @@ if __name__ == "__main__":
     print("This will test various query types to demonstrate functionality")
     print("="*60)
     
-    test_questions()
+    # Initialize agent
+    print("Initializing agent...")
+    agent = OllamaAgent()
+    print("Agent ready!\n")
+    print("="*60)
+    
+    test_questions(agent)
     
     print("\n✅ Demo completed!")
     print("\nThese questions demonstrate:")
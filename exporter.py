@@ -0,0 +1,177 @@
+"""
+Exporter - Streams query results to CSV or Parquet in fixed-size chunks
+"""
+import csv
+import io
+import math
+import os
+import time
+import uuid
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet'
+}
+
+
+def flatten_document(doc, prefix=''):
+    """Flatten nested fields (e.g. grouped _id) into dotted column names"""
+    row = {}
+    for key, value in doc.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            row.update(flatten_document(value, name + '.'))
+        elif value is None or isinstance(value, (str, int, float, bool)):
+            row[name] = value
+        else:
+            row[name] = str(value)
+    return row
+
+
+def iter_chunks(docs, chunk_size):
+    """Group documents into lists of flattened rows"""
+    chunk = []
+    for doc in docs:
+        chunk.append(flatten_document(doc))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def csv_chunks(docs, chunk_size):
+    """Yield CSV bytes, one piece per chunk of documents"""
+    writer = None
+    buffer = io.StringIO()
+    for rows in iter_chunks(docs, chunk_size):
+        if writer is None:
+            # Header covers every column in the first chunk; a new column later raises ValueError
+            fieldnames = list(dict.fromkeys(name for row in rows for name in row))
+            writer = csv.DictWriter(buffer, fieldnames=fieldnames)
+            writer.writeheader()
+        writer.writerows(rows)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object that hands written bytes back to the caller"""
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _arrow_schema(rows):
+    """Numeric columns become float64, everything else string"""
+    fields = []
+    for name in rows[0]:
+        values = [row.get(name) for row in rows]
+        present = [v for v in values if v is not None and not (isinstance(v, float) and math.isnan(v))]
+        numeric = bool(present) and all(_is_number(v) for v in present)
+        fields.append(pa.field(name, pa.float64() if numeric else pa.string()))
+    return pa.schema(fields)
+
+
+def _arrow_table(rows, schema):
+    frame = pd.DataFrame(rows).reindex(columns=schema.names)
+    for field in schema:
+        column = frame[field.name]
+        if pa.types.is_floating(field.type):
+            frame[field.name] = pd.to_numeric(column, errors='coerce')
+        else:
+            frame[field.name] = column.map(
+                lambda v: None if v is None or (isinstance(v, float) and math.isnan(v)) else str(v)
+            )
+    return pa.Table.from_pandas(frame, schema=schema, preserve_index=False)
+
+
+def parquet_chunks(docs, chunk_size):
+    """Yield Parquet bytes, writing one row group per chunk of documents"""
+    if pa is None:
+        raise ImportError("Parquet export requires pyarrow (pip install pyarrow)")
+
+    sink = _ChunkSink()
+    writer = None
+    try:
+        for rows in iter_chunks(docs, chunk_size):
+            if writer is None:
+                schema = _arrow_schema(rows)
+                writer = pq.ParquetWriter(sink, schema)
+            writer.write_table(_arrow_table(rows, schema))
+            yield sink.drain()
+    finally:
+        if writer is not None:
+            writer.close()
+    yield sink.drain()
+
+
+def export_chunks(docs, fmt, chunk_size):
+    """Serialize documents to the requested format as a stream of byte chunks"""
+    if fmt == 'csv':
+        return csv_chunks(docs, chunk_size)
+    if fmt == 'parquet':
+        return parquet_chunks(docs, chunk_size)
+    raise ValueError(f"Unsupported export format: {fmt}")
+
+
+def write_export_file(chunks, directory, fmt):
+    """Write export chunks to a uniquely named file in directory and return its name.
+
+    The file only appears under its final name once it is complete.
+    """
+    os.makedirs(directory, exist_ok=True)
+    name = f"{uuid.uuid4().hex}.{fmt}"
+    partial = os.path.join(directory, name + '.part')
+    try:
+        with open(partial, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(partial, os.path.join(directory, name))
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return name
+
+
+def remove_stale_exports(directory, max_age):
+    """Delete export files older than max_age seconds"""
+    if not os.path.isdir(directory):
+        return
+    cutoff = time.time() - max_age
+    for entry in os.scandir(directory):
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            pass
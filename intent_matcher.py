@@ -0,0 +1,200 @@
+"""
+Intent Matcher - Compiled keyword matching and intent scoring for user questions
+"""
+import re
+
+# Keyword groups used by the intent table (two-word phrases match adjacent words)
+SUPERLATIVE = frozenset({'highest', 'most', 'top', 'biggest', 'largest'})
+SPENDING = frozenset({'spending', 'spent', 'spend'})
+ITEM = frozenset({'sales', 'item', 'items', 'product', 'products'})
+DEPARTMENT = frozenset({'department', 'departments'})
+SUPPLIER = frozenset({'supplier', 'suppliers', 'vendor', 'vendors'})
+MONTH = frozenset({'month', 'months', 'monthly'})
+QUARTER = frozenset({'quarter', 'quarters', 'quarterly'})
+
+# Intent scoring table: (query_type, required keyword groups, weight).
+# An intent applies when every group has at least one keyword in the question;
+# the highest weight wins and ties go to the earlier row.
+INTENT_TABLE = [
+    ('histogram', (frozenset({'histogram', 'distribution'}),), 95),
+    ('cube', (frozenset({'breakdown', 'break down', 'broken down', 'drill down', 'drilldown', 'pivot', 'cube'}),), 95),
+    ('percentile', (frozenset({'median', 'percentile', 'quartile', 'p10', 'p25', 'p50', 'p75', 'p90', 'p95', 'p99'}),), 95),
+    ('highest_quarter', (QUARTER, SUPERLATIVE, SPENDING), 90),
+    ('monthly_analysis', (MONTH, frozenset({'trend', 'trends', 'analysis'})), 80),
+    ('comparison', (frozenset({'compare', 'comparison'}), frozenset({'between', 'vs', 'versus'})), 80),
+    ('most_expensive', (frozenset({'expensive'}), frozenset({'most', 'top'})), 70),
+    ('frequency', (frozenset({'frequently', 'frequent', 'most ordered', 'most times'}),), 70),
+    ('acquisition_methods', (frozenset({'acquisition method', 'acquisition methods'}),), 70),
+    ('trend_analysis', (frozenset({'trend', 'trends', 'over time', 'yearly', 'annual'}),), 60),
+    ('top_items', (SUPERLATIVE, ITEM), 60),
+    ('top_departments', (DEPARTMENT, SUPERLATIVE), 50),
+    ('top_suppliers', (SUPPLIER,), 40),
+    ('average', (frozenset({'average', 'avg', 'mean'}),), 30),
+    ('count', (frozenset({'count', 'how many', 'number of'}),), 30),
+    ('sum', (SPENDING | {'total'},), 20),
+    ('list', (frozenset({'show', 'list', 'find', 'purchases', 'orders'}),), 10),
+]
+
+# Breakdown dimensions of the spend cube and the words that name them
+DIMENSION_TABLE = [
+    ('fiscal_year', frozenset({'year', 'years', 'yearly', 'annual', 'fiscal year'})),
+    ('quarter', QUARTER),
+    ('month', MONTH),
+    ('department', DEPARTMENT),
+    ('supplier', SUPPLIER),
+    ('acquisition_method', frozenset({'acquisition method', 'acquisition methods', 'method', 'methods'})),
+]
+
+# Year mentions in precedence order, mapped to the fiscal year they select
+YEAR_TABLE = [
+    ('2013', '2013-2014'),
+    ('2012', '2012-2013'),
+    ('2014', '2014-2015'),
+    ('2015', '2014-2015'),
+]
+
+QUARTER_TABLE = [
+    ('Q1', frozenset({'q1', 'first quarter'})),
+    ('Q2', frozenset({'q2', 'second quarter'})),
+    ('Q3', frozenset({'q3', 'third quarter'})),
+    ('Q4', frozenset({'q4', 'fourth quarter'})),
+    ('FQ1', frozenset({'fq1'})),
+    ('FQ2', frozenset({'fq2'})),
+    ('FQ3', frozenset({'fq3'})),
+    ('FQ4', frozenset({'fq4'})),
+]
+
+DEPARTMENT_TABLE = [
+    ('Information Technology', frozenset({'IT', 'information technology'})),
+    ('Health', frozenset({'health'})),
+]
+
+# "p95" on its own, or "95th" / "95" written next to "percentile"
+PERCENTILE_KEYWORD_PATTERN = re.compile(r'^p(\d{1,2})$')
+ORDINAL_PATTERN = re.compile(r'^(\d{1,2})(?:st|nd|rd|th)?$')
+PERCENTILE_WORDS = frozenset({'percentile', 'percentiles'})
+
+MILLION = frozenset({'million', '1000000'})
+THOUSAND = frozenset({'thousand', '1000'})
+
+# Keywords that only count when written exactly (e.g. "IT", not the pronoun "it")
+CASE_SENSITIVE = frozenset({'IT'})
+
+WORD_PATTERN = re.compile(r'[A-Za-z0-9]+')
+
+
+def tokenize(question):
+    """Return the words and two-word phrases of a question in a single pass"""
+    found = set()
+    previous = None
+    for word in WORD_PATTERN.findall(question):
+        if word in CASE_SENSITIVE:
+            found.add(word)
+        word = word.lower()
+        found.add(word)
+        if previous is not None:
+            found.add(previous + ' ' + word)
+        previous = word
+    return found
+
+
+def fold_case(question):
+    """Lowercase a question except for case-sensitive keywords, for use as a cache key"""
+    if not any(word in question for word in CASE_SENSITIVE):
+        return question.lower()
+    return WORD_PATTERN.sub(
+        lambda m: m.group(0) if m.group(0) in CASE_SENSITIVE else m.group(0).lower(),
+        question
+    )
+
+
+def _has_any(found, group):
+    return not group.isdisjoint(found)
+
+
+def detect_filters(found):
+    """Build the filters dict from matched keywords"""
+    filters = {}
+
+    for year, fiscal_year in YEAR_TABLE:
+        if year in found:
+            filters['Fiscal Year'] = fiscal_year
+            break
+
+    for quarter, words in QUARTER_TABLE:
+        if _has_any(found, words):
+            filters['quarter'] = quarter
+            break
+
+    if 'over' in found and _has_any(found, MILLION):
+        filters['min_price'] = 1000000
+    elif 'under' in found and _has_any(found, THOUSAND):
+        filters['max_price'] = 1000
+
+    for name, words in DEPARTMENT_TABLE:
+        if _has_any(found, words):
+            filters['Department Name'] = {'$regex': name, '$options': 'i'}
+            break
+
+    return filters
+
+
+def score_intents(found):
+    """Return the best matching query type, or None when nothing applies"""
+    best_type, best_weight = None, 0
+    for query_type, groups, weight in INTENT_TABLE:
+        if weight > best_weight and all(_has_any(found, g) for g in groups):
+            best_type, best_weight = query_type, weight
+    return best_type
+
+
+def detect_percentile(found):
+    """Percentile asked for (e.g. 95 for "95th percentile"), defaulting to the median"""
+    if 'upper quartile' in found:
+        return 75
+    if 'lower quartile' in found:
+        return 25
+    for word in sorted(found):
+        match = PERCENTILE_KEYWORD_PATTERN.match(word)
+        if ' ' in word:
+            first, second = word.split(' ')
+            if second in PERCENTILE_WORDS:
+                match = ORDINAL_PATTERN.match(first)
+            elif first in PERCENTILE_WORDS:
+                match = ORDINAL_PATTERN.match(second)
+        if match:
+            value = int(match.group(1))
+            if 0 < value < 100:
+                return value
+    return 50
+
+
+def detect_dimensions(question):
+    """Cube dimensions mentioned in the question, in the order they appear"""
+    words = [word.lower() for word in WORD_PATTERN.findall(question)]
+    dimensions = []
+    for i, word in enumerate(words):
+        candidates = [word]
+        if i + 1 < len(words):
+            candidates.insert(0, word + ' ' + words[i + 1])
+        for dimension, names in DIMENSION_TABLE:
+            if dimension not in dimensions and not names.isdisjoint(candidates):
+                dimensions.append(dimension)
+                break
+    return dimensions
+
+
+def match_intent(question):
+    """Parse a question into (query_type or None, filters, parameters)"""
+    found = tokenize(question)
+    query_type = score_intents(found)
+    parameters = {}
+    if query_type == 'percentile':
+        parameters['percentile'] = detect_percentile(found)
+    # Any question split "by" two or more dimensions becomes a cube breakdown
+    if query_type == 'cube' or 'by' in found:
+        dimensions = detect_dimensions(question)
+        if query_type == 'cube' or len(dimensions) >= 2:
+            query_type = 'cube'
+            parameters = {'group_by': dimensions or ['fiscal_year']}
+    return query_type, detect_filters(found), parameters
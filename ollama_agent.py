@@ -2,11 +2,113 @@
 Ollama Agent - Handles natural language queries for procurement data
 """
 import requests
+import os
 import json
+import re
+import time
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from pymongo import MongoClient
-from config import MONGODB_CONFIG
+from config import MONGODB_CONFIG, OLLAMA_CONFIG, CACHE_CONFIG, STREAM_CONFIG, EXPORT_CONFIG, CUBE_CONFIG
+from cache import LRUCache
+from intent_matcher import match_intent, fold_case
+from spend_cube import (
+    SpendCube, DIMENSION_LABELS, MONTH_LABELS, FISCAL_QUARTER_BY_MONTH, FISCAL_QUARTER_BY_CALENDAR_QUARTER
+)
+from sketches import PriceSketch, HISTOGRAM_LABELS, histogram_counts
+from partitions import (
+    partition_collections, prune_partitions, fan_out_aggregate, is_row_pipeline,
+    sorted_rows_plan, merge_sorted_partitions
+)
+from exporter import export_chunks
 from datetime import datetime
 
+# Query types the pipeline generator understands, with the hints given to the LLM
+QUERY_TYPES = {
+    'sum': 'total spending',
+    'average': 'average purchase amount',
+    'count': 'number of purchases',
+    'most_expensive': 'the most expensive individual purchases',
+    'highest_quarter': 'quarters ranked by spending',
+    'monthly_analysis': 'spending per month',
+    'trend_analysis': 'spending per fiscal year over time',
+    'comparison': 'side-by-side comparison of fiscal years',
+    'top_items': 'items ranked by total sales',
+    'frequency': 'items ranked by how often they were ordered',
+    'top_departments': 'departments ranked by spending',
+    'top_suppliers': 'suppliers ranked by revenue',
+    'acquisition_methods': 'breakdown by acquisition method',
+    'percentile': 'a percentile of purchase amounts, such as the median',
+    'histogram': 'distribution of purchase amounts by price range',
+    'cube': 'spending broken down by year, quarter, month, department, supplier or acquisition method',
+    'list': 'a plain list of purchase records'
+}
+
+# Query types answered with a single line instead of a ranked list
+SCALAR_QUERY_TYPES = ('sum', 'average', 'count', 'percentile')
+
+# Query types answered from precomputed price sketches
+DISTRIBUTION_QUERY_TYPES = ('percentile', 'histogram')
+
+# Query types answered from in-memory structures rather than a streamed cursor
+IN_MEMORY_QUERY_TYPES = DISTRIBUTION_QUERY_TYPES + ('cube',)
+
+# Filter field -> spend cube dimension
+CUBE_FILTER_DIMENSIONS = {
+    'Fiscal Year': 'fiscal_year',
+    'quarter': 'quarter',
+    'Department Name': 'department',
+    'Supplier Name': 'supplier',
+    'Acquisition Method': 'acquisition_method'
+}
+
+# Spend cube dimension -> source field for the aggregation fallback
+CUBE_FIELDS = {
+    'fiscal_year': '$Fiscal Year',
+    'quarter': '$quarter',
+    'month': '$month',
+    'department': '$Department Name',
+    'supplier': '$Supplier Name',
+    'acquisition_method': '$Acquisition Method'
+}
+
+# Filters that can be answered from sketches: filter field -> sketch dimension
+SKETCH_FILTER_DIMENSIONS = {
+    'Department Name': 'department'
+}
+
+RESPONSE_HEADERS = {
+    'most_expensive': "## Top 10 Most Expensive Purchases:\n\n",
+    'highest_quarter': "## Quarterly Spending Analysis:\n\n",
+    'monthly_analysis': "## Monthly Spending Trend:\n\n",
+    'trend_analysis': "## Spending Trend Over Time:\n\n",
+    'comparison': "## Year-over-Year Comparison:\n\n",
+    'top_items': "## Items with Highest Sales:\n\n",
+    'frequency': "## Most Frequently Ordered Items:\n\n",
+    'top_departments': "## Top Departments by Spending:\n\n",
+    'top_suppliers': "## Top Suppliers by Revenue:\n\n",
+    'acquisition_methods': "## Acquisition Methods Analysis:\n\n",
+    'histogram': "## Purchase Amount Distribution:\n\n",
+    'cube': "## Spending Breakdown:\n\n"
+}
+
+# Maximum rows shown for query types whose pipeline isn't already limited
+ROW_LIMITS = {
+    'acquisition_methods': 10,
+    'cube': 20,
+    'list': 10
+}
+
+NO_RESULTS_MESSAGE = "No results found. Try rephrasing your question or check the date range."
+
+def ordinal(n):
+    """1 -> 1st, 2 -> 2nd, 95 -> 95th"""
+    if 10 <= n % 100 <= 20:
+        return f"{n}th"
+    return f"{n}{ {1: 'st', 2: 'nd', 3: 'rd'}.get(n % 10, 'th') }"
+
 class OllamaAgent:
     def __init__(self):
         self.client = MongoClient(
@@ -15,76 +117,138 @@ class OllamaAgent:
         )
         self.db = self.client[MONGODB_CONFIG['database']]
         self.collection = self.db[MONGODB_CONFIG['collection']]
-        self.ollama_url = "http://localhost:11434/api/generate"
+        
+        # Year partitions (fiscal year -> collection), discovered on first use
+        self.partitioned = MONGODB_CONFIG['partitioned']
+        self.partitions = None
+        self.executor = ThreadPoolExecutor(max_workers=MONGODB_CONFIG['fanout_workers'])
+        
+        # Spend cube (aggregate lattice), loaded on first breakdown question
+        self.cube = None
+        
+        self.ollama_url = OLLAMA_CONFIG['url']
+        
+        # Persistent HTTP session so LLM calls reuse pooled connections
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=OLLAMA_CONFIG['pool_size']
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        
+        # Prebuilt (query_info, pipeline) plans keyed by normalized question
+        self.plan_cache = LRUCache(CACHE_CONFIG['plan_cache_size'])
+        
+        # LLM-derived query types keyed by question shape
+        self.llm_plan_cache = LRUCache(CACHE_CONFIG['llm_plan_cache_size'])
+        
+        # Formatted answers keyed by normalized question, stored as (data version, answer)
+        self.answer_cache = LRUCache(CACHE_CONFIG['answer_cache_size'])
+        self.data_version = None
+        self.data_version_checked = 0
+        self.version_lock = threading.Lock()
         
     def understand_query(self, question):
         """Parse and understand user query"""
+        query_type, filters, parameters = match_intent(question)
+        if query_type is None:
+            return self.llm_understand_query(question, filters)
+        return {'query_type': query_type, 'filters': filters, **parameters}
+    
+    def plan_query(self, question):
+        """Return (query_info, pipeline) for a question, reusing cached plans.
+        
+        Cached plans are shared between calls, so callers must not modify them.
+        """
+        key = self.cache_key(question)
+        plan = self.plan_cache.get(key)
+        if plan is None:
+            query_info = self.understand_query(question)
+            plan = (query_info, self.generate_mongodb_query(query_info))
+            # A failed LLM classification is retried next time instead of cached
+            if not query_info.get('fallback'):
+                self.plan_cache.put(key, plan)
+        return plan
+    
+    def cache_key(self, question):
+        """Key for the plan and answer caches (case and spacing insensitive, except "IT")"""
+        return ' '.join(fold_case(question).strip(' ?!.').split())
+    
+    def normalize_question(self, question):
+        """Reduce a question to its shape (lowercase, numbers masked, no punctuation)"""
         q = question.lower()
+        q = re.sub(r'\d+(?:[.,]\d+)*', '#', q)
+        q = re.sub(r'[^a-z#]+', ' ', q)
+        return q.strip()
+    
+    def llm_understand_query(self, question, filters):
+        """Fall back to the LLM for questions the keyword rules don't recognize"""
+        key = self.normalize_question(question)
         
-        # Year and time filtering
-        filters = {}
-        
-        # Year detection
-        if '2013' in question:
-            filters['Fiscal Year'] = '2013-2014'
-        elif '2012' in question:
-            filters['Fiscal Year'] = '2012-2013'
-        elif '2014' in question:
-            filters['Fiscal Year'] = '2014-2015'
-        elif '2015' in question:
-            filters['Fiscal Year'] = '2014-2015'
-        
-        # Quarter detection
-        if 'q1' in q or 'first quarter' in q:
-            filters['quarter'] = 'Q1'
-        elif 'q2' in q or 'second quarter' in q:
-            filters['quarter'] = 'Q2'
-        elif 'q3' in q or 'third quarter' in q:
-            filters['quarter'] = 'Q3'
-        elif 'q4' in q or 'fourth quarter' in q:
-            filters['quarter'] = 'Q4'
-        
-        # Price range detection
-        if 'over' in q and ('million' in q or '1000000' in q):
-            filters['min_price'] = 1000000
-        elif 'under' in q and ('thousand' in q or '1000' in q):
-            filters['max_price'] = 1000
-        
-        # Department detection
-        if 'it ' in q or 'information technology' in q:
-            filters['Department Name'] = {'$regex': 'Information Technology', '$options': 'i'}
-        elif 'health' in q:
-            filters['Department Name'] = {'$regex': 'Health', '$options': 'i'}
-        
-        # Query type detection
-        if 'quarter' in q and ('highest' in q or 'most' in q) and 'spending' in q:
-            return {'query_type': 'highest_quarter', 'filters': filters}
-        elif ('month' in q or 'monthly' in q) and ('trend' in q or 'analysis' in q):
-            return {'query_type': 'monthly_analysis', 'filters': filters}
-        elif 'trend' in q or 'over time' in q:
-            return {'query_type': 'trend_analysis', 'filters': filters}
-        elif 'compare' in q and ('between' in q or 'vs' in q):
-            return {'query_type': 'comparison', 'filters': filters}
-        elif 'expensive' in q and ('most' in q or 'top' in q):
-            return {'query_type': 'most_expensive', 'filters': filters}
-        elif ('highest' in q or 'most' in q) and ('sales' in q or 'item' in q or 'product' in q):
-            return {'query_type': 'top_items', 'filters': filters}
-        elif 'frequently' in q or 'frequent' in q or 'most ordered' in q or 'most times' in q:
-            return {'query_type': 'frequency', 'filters': filters}
-        elif 'total' in q or 'spending' in q:
-            return {'query_type': 'sum', 'filters': filters}
-        elif 'average' in q:
-            return {'query_type': 'average', 'filters': filters}
-        elif 'count' in q or 'how many' in q:
-            return {'query_type': 'count', 'filters': filters}
-        elif 'department' in q and 'most' in q:
-            return {'query_type': 'top_departments', 'filters': filters}
-        elif 'supplier' in q:
-            return {'query_type': 'top_suppliers', 'filters': filters}
-        elif 'acquisition method' in q:
-            return {'query_type': 'acquisition_methods', 'filters': filters}
-        else:
-            return {'query_type': 'list', 'filters': filters}
+        query_type = self.llm_plan_cache.get(key)
+        if query_type is None:
+            query_type = self.ask_ollama_for_query_type(question)
+            if query_type is not None:
+                self.llm_plan_cache.put(key, query_type)
+        
+        if query_type is None:
+            return {'query_type': 'list', 'filters': filters, 'fallback': True}
+        return {'query_type': query_type, 'filters': filters}
+    
+    def ask_ollama_for_query_type(self, question):
+        """Ask Ollama to classify a question; returns a validated query type or None"""
+        options = "\n".join(f"- {name}: {hint}" for name, hint in QUERY_TYPES.items())
+        prompt = (
+            "You classify questions about California State procurement data.\n"
+            "Choose the single query type that best answers the question:\n"
+            f"{options}\n\n"
+            f"Question: {question}\n\n"
+            'Reply with JSON only, like {"query_type": "sum"}.'
+        )
+        payload = {
+            'model': OLLAMA_CONFIG['model'],
+            'prompt': prompt,
+            'format': 'json',
+            'stream': True,
+            'options': {'temperature': 0, 'num_predict': 64}
+        }
+        timeout = (OLLAMA_CONFIG['connect_timeout'], OLLAMA_CONFIG['read_timeout'])
+        deadline = time.monotonic() + OLLAMA_CONFIG['read_timeout']
+        
+        text = ""
+        try:
+            with self.session.post(self.ollama_url, json=payload, stream=True, timeout=timeout) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    text += chunk.get('response', '')
+                    if chunk.get('done'):
+                        break
+                    if time.monotonic() > deadline:
+                        print("LLM fallback error: response took too long")
+                        return None
+        except (requests.RequestException, ValueError) as e:
+            print(f"LLM fallback error: {e}")
+            return None
+        
+        return self.parse_llm_plan(text)
+    
+    def parse_llm_plan(self, text):
+        """Extract a known query type from the LLM reply"""
+        match = re.search(r'\{.*\}', text, re.DOTALL)
+        if not match:
+            return None
+        try:
+            plan = json.loads(match.group(0))
+        except ValueError:
+            return None
+        query_type = plan.get('query_type') if isinstance(plan, dict) else None
+        if isinstance(query_type, str) and query_type in QUERY_TYPES:
+            return query_type
+        return None
             
     def generate_mongodb_query(self, query_info):
         """Generate MongoDB aggregation pipeline"""
@@ -127,6 +291,7 @@ class OllamaAgent:
             pipeline.append({'$limit': 10})
             
         elif query_type == 'highest_quarter':
+            # Calendar quarters (Q1 = Jan-Mar); the spend cube uses fiscal quarters (FQ1 = Jul-Sep)
             pipeline = [
                 {'$addFields': {
                     'month': {'$month': {'$dateFromString': {
@@ -258,6 +423,40 @@ class OllamaAgent:
                 {'$sort': {'count': -1}}
             ]
             
+        elif query_type == 'cube':
+            # Aggregation fallback when the spend cube can't answer
+            group_by = query_info.get('group_by') or ['fiscal_year']
+            if {'quarter', 'month'} & set(group_by) or 'quarter' in filters:
+                pipeline.append(self.month_number_stage())
+                pipeline.append({'$addFields': {
+                    'quarter': {'$ifNull': [
+                        {'$arrayElemAt': [FISCAL_QUARTER_BY_MONTH, {'$subtract': ['$month_num', 1]}]},
+                        'Unknown'
+                    ]},
+                    'month': {'$ifNull': [
+                        {'$arrayElemAt': [MONTH_LABELS, {'$subtract': ['$month_num', 1]}]},
+                        'Unknown'
+                    ]}
+                }})
+            if 'quarter' in filters:
+                pipeline.append({'$match': {'quarter': self.fiscal_quarter(filters['quarter'])}})
+            pipeline.append({'$group': {
+                '_id': {dim: {'$ifNull': [CUBE_FIELDS[dim], 'Unknown']} for dim in group_by},
+                'sum': {'$sum': '$Total Price'},
+                'count': {'$sum': 1},
+                'min': {'$min': '$Total Price'},
+                'max': {'$max': '$Total Price'},
+                'avg': {'$avg': '$Total Price'}
+            }})
+            pipeline.append({'$sort': {'sum': -1}})
+            
+        elif query_type in DISTRIBUTION_QUERY_TYPES:
+            # Exact fallback when no sketch covers the filters
+            if 'quarter' in filters:
+                pipeline.append(self.month_number_stage())
+                pipeline.append({'$match': {'month_num': {'$in': self.quarter_months(filters['quarter'])}}})
+            pipeline.append({'$project': {'_id': 0, 'Total Price': 1}})
+            
         else:
             pipeline.append({'$limit': 10})
             
@@ -266,6 +465,10 @@ class OllamaAgent:
     def execute_query(self, pipeline):
         """Execute MongoDB query with better error handling"""
         try:
+            if self.partitioned:
+                collections = prune_partitions(self.get_partitions(), pipeline)
+                return fan_out_aggregate(collections, pipeline, self.executor)
+            
             # Allow disk use for large aggregations
             results = list(self.collection.aggregate(pipeline, allowDiskUse=True))
             return results
@@ -273,145 +476,471 @@ class OllamaAgent:
             print(f"Query execution error: {e}")
             print(f"Pipeline: {pipeline}")
             return None
-            
-    def format_response(self, results, query_info, question):
-        """Format results into readable response"""
-        if not results:
-            return "No results found. Try rephrasing your question or check the date range."
-            
-        query_type = query_info.get('query_type')
+    
+    def run_query(self, query_info, pipeline):
+        """Execute a planned query, routing distribution questions to the sketches"""
+        if query_info.get('query_type') in DISTRIBUTION_QUERY_TYPES:
+            try:
+                return self.execute_distribution_query(query_info, pipeline)
+            except Exception as e:
+                print(f"Distribution query error: {e}")
+                return None
+        if query_info.get('query_type') == 'cube':
+            return self.execute_cube_query(query_info, pipeline)
+        return self.execute_query(pipeline)
+    
+    def get_cube(self):
+        """Spend cube written by data_loader.py, loaded on first use"""
+        if self.cube is None and os.path.exists(CUBE_CONFIG['path']):
+            try:
+                self.cube = SpendCube.load(CUBE_CONFIG['path'])
+            except Exception as e:
+                print(f"Spend cube load error: {e}")
+        return self.cube
+    
+    def cube_filters(self, filters):
+        """Translate query filters into a cube slice, or None if the cube can't express them"""
+        where = {}
+        for key, value in filters.items():
+            dimension = CUBE_FILTER_DIMENSIONS.get(key)
+            if dimension is None:
+                return None
+            if isinstance(value, dict):
+                if set(value) - {'$regex', '$options'}:
+                    return None
+                flags = re.IGNORECASE if 'i' in value.get('$options', '') else 0
+                value = re.compile(value['$regex'], flags)
+            if dimension == 'quarter':
+                value = self.fiscal_quarter(value)
+            where[dimension] = value
+        return where
+    
+    def month_number_stage(self):
+        """$addFields stage setting month_num (1-12, or None) from the Creation Date"""
+        return {'$addFields': {
+            'month_num': {'$month': {'$dateFromString': {
+                'dateString': '$Creation Date',
+                'onError': None,
+                'onNull': None
+            }}}
+        }}
+    
+    def quarter_months(self, quarter):
+        """Calendar months (1-12) in a quarter filter such as 'Q1' or 'FQ1'"""
+        fiscal = self.fiscal_quarter(quarter)
+        return [month for month, label in enumerate(FISCAL_QUARTER_BY_MONTH, 1) if label == fiscal]
+    
+    def fiscal_quarter(self, quarter):
+        """Fiscal quarter label (FQ1-FQ4) for a calendar quarter filter such as 'Q1'"""
+        return FISCAL_QUARTER_BY_CALENDAR_QUARTER.get(quarter, quarter)
+    
+    def execute_cube_query(self, query_info, pipeline):
+        """Answer a breakdown from the spend cube, falling back to an aggregation"""
+        group_by = query_info.get('group_by') or ['fiscal_year']
+        cube = self.get_cube()
+        where = self.cube_filters(query_info.get('filters', {}))
+        if cube is not None and where is not None:
+            try:
+                return cube.query(group_by, where)
+            except Exception as e:
+                print(f"Spend cube query error: {e}")
+        
+        results = self.execute_query(pipeline)
+        if results is None:
+            return None
+        return [{**doc['_id'], **{k: v for k, v in doc.items() if k != '_id'}} for doc in results]
+    
+    def load_price_sketch(self, filters):
+        """Merge the precomputed sketches matching the filters, or None if they can't answer"""
+        # Sketches are per fiscal year, so price and quarter filters need the exact query
+        if {'min_price', 'max_price', 'quarter'} & set(filters):
+            return None
+        
+        criteria = {'dimension': 'fiscal_year'}
+        dimension_filters = [key for key in SKETCH_FILTER_DIMENSIONS if key in filters]
+        if len(dimension_filters) > 1:
+            return None
+        if dimension_filters:
+            key = dimension_filters[0]
+            criteria = {'dimension': SKETCH_FILTER_DIMENSIONS[key], 'key': filters[key]}
+        if 'Fiscal Year' in filters:
+            criteria['fiscal_year'] = filters['Fiscal Year']
         
+        docs = self.db[MONGODB_CONFIG['sketch_collection']].find(criteria, {'sketch': 1})
+        return PriceSketch.merge(PriceSketch.from_document(doc['sketch']) for doc in docs)
+    
+    def execute_distribution_query(self, query_info, pipeline):
+        """Answer percentile / histogram questions from sketches, or exactly as a fallback"""
+        sketch = self.load_price_sketch(query_info.get('filters', {}))
+        if sketch is not None:
+            source = 'sketch'
+            count = sketch.count
+            histogram = sketch.histogram
+        else:
+            source = 'exact'
+            prices = np.fromiter(
+                (doc.get('Total Price') or 0
+                 for doc in self.stream_query(pipeline, batch_size=EXPORT_CONFIG['chunk_size'])),
+                dtype=float
+            )
+            count = len(prices)
+            histogram = histogram_counts(prices)
+        
+        if count == 0:
+            return []
+        
+        if query_info.get('query_type') == 'percentile':
+            percentile = query_info.get('percentile', 50)
+            if source == 'sketch':
+                value = sketch.quantile(percentile / 100)
+            else:
+                value = float(np.percentile(prices, percentile))
+            return [{'percentile': percentile, 'value': value, 'count': count, 'source': source}]
+        
+        return [
+            {'range': label, 'count': int(n), 'share': n / count, 'source': source}
+            for label, n in zip(HISTOGRAM_LABELS, histogram)
+            if n
+        ]
+    
+    def get_partitions(self):
+        """Fiscal year -> collection map for the partitioned layout"""
+        if self.partitions is None:
+            self.partitions = partition_collections(self.db)
+        return self.partitions
+    
+    def stream_query(self, pipeline, batch_size=None):
+        """Yield result documents as the cursor delivers them"""
+        batch_size = batch_size or STREAM_CONFIG['batch_size']
+        collection = self.collection
+        if self.partitioned:
+            collections = prune_partitions(self.get_partitions(), pipeline)
+            if len(collections) > 1 and is_row_pipeline(pipeline):
+                # Unordered row results can be read partition by partition
+                for collection in collections:
+                    with collection.aggregate(pipeline, allowDiskUse=True, batchSize=batch_size) as cursor:
+                        yield from cursor
+                return
+            plan = sorted_rows_plan(pipeline) if len(collections) > 1 else None
+            if plan is not None:
+                # Sorted rows are merged from per-partition cursors without buffering them
+                yield from merge_sorted_partitions(collections, pipeline, *plan, self.executor, batch_size)
+                return
+            if len(collections) != 1:
+                # Fan-out results are merged before they can be ranked
+                yield from fan_out_aggregate(collections, pipeline, self.executor)
+                return
+            collection = collections[0]
+        
+        cursor = collection.aggregate(
+            pipeline,
+            allowDiskUse=True,
+            batchSize=batch_size
+        )
+        with cursor:
+            for doc in cursor:
+                yield doc
+            
+    def format_header(self, query_type):
+        """Heading shown above ranked results"""
+        return RESPONSE_HEADERS.get(query_type, "## Query Results:\n\n")
+    
+    def format_row(self, item, i, query_type):
+        """Format a single result document"""
         if query_type == 'sum':
-            total = results[0].get('total', 0)
+            total = item.get('total', 0)
             return f"**Total Spending:** ${total:,.2f}"
             
         elif query_type == 'average':
-            avg = results[0].get('average', 0)
+            avg = item.get('average', 0)
             return f"**Average Purchase Amount:** ${avg:,.2f}"
             
         elif query_type == 'count':
-            count = results[0].get('total', 0)
+            count = item.get('total', 0)
             return f"**Total Number of Purchases:** {count:,}"
             
         elif query_type == 'most_expensive':
-            response = "## Top 10 Most Expensive Purchases:\n\n"
-            for i, item in enumerate(results, 1):
-                response += f"**{i}.** {item.get('Item Name', 'N/A')}\n"
-                response += f"   - Price: ${item.get('Total Price', 0):,.2f}\n"
-                response += f"   - Supplier: {item.get('Supplier Name', 'N/A')}\n"
-                response += f"   - Department: {item.get('Department Name', 'N/A')}\n\n"
-            return response
+            row = f"**{i}.** {item.get('Item Name', 'N/A')}\n"
+            row += f"   - Price: ${item.get('Total Price', 0):,.2f}\n"
+            row += f"   - Supplier: {item.get('Supplier Name', 'N/A')}\n"
+            row += f"   - Department: {item.get('Department Name', 'N/A')}\n\n"
+            return row
             
         elif query_type == 'highest_quarter':
-            response = "## Quarterly Spending Analysis:\n\n"
-            for i, item in enumerate(results, 1):
-                fy = item['_id'].get('fiscal_year', 'N/A')
-                quarter = item['_id'].get('quarter', 'N/A')
-                response += f"**{i}. {fy} - {quarter}**\n"
-                response += f"   - Total: ${item['total_spending']:,.2f}\n"
-                response += f"   - Orders: {item['count']:,}\n\n"
-            return response
+            fy = item['_id'].get('fiscal_year', 'N/A')
+            quarter = item['_id'].get('quarter', 'N/A')
+            row = f"**{i}. {fy} - {quarter}**\n"
+            row += f"   - Total: ${item['total_spending']:,.2f}\n"
+            row += f"   - Orders: {item['count']:,}\n\n"
+            return row
             
         elif query_type == 'monthly_analysis':
-            response = "## Monthly Spending Trend:\n\n"
-            for item in results:
-                year = item['_id'].get('year', 'N/A')
-                month = item['_id'].get('month', 'N/A')
-                response += f"**{year}-{month:02d}:**\n"
-                response += f"   - Total: ${item['total']:,.2f}\n"
-                response += f"   - Orders: {item['count']:,}\n"
-                response += f"   - Average: ${item['avg']:,.2f}\n\n"
-            return response
+            year = item['_id'].get('year', 'N/A')
+            month = item['_id'].get('month', 'N/A')
+            row = f"**{year}-{month:02d}:**\n"
+            row += f"   - Total: ${item['total']:,.2f}\n"
+            row += f"   - Orders: {item['count']:,}\n"
+            row += f"   - Average: ${item['avg']:,.2f}\n\n"
+            return row
             
         elif query_type == 'trend_analysis':
-            response = "## Spending Trend Over Time:\n\n"
-            for item in results:
-                response += f"**{item['_id']}:**\n"
-                response += f"   - Total Spending: ${item['total_spending']:,.2f}\n"
-                response += f"   - Total Orders: {item['total_orders']:,}\n"
-                response += f"   - Average Order: ${item['avg_order']:,.2f}\n\n"
-            return response
+            row = f"**{item['_id']}:**\n"
+            row += f"   - Total Spending: ${item['total_spending']:,.2f}\n"
+            row += f"   - Total Orders: {item['total_orders']:,}\n"
+            row += f"   - Average Order: ${item['avg_order']:,.2f}\n\n"
+            return row
             
         elif query_type == 'comparison':
-            response = "## Year-over-Year Comparison:\n\n"
-            for item in results:
-                response += f"**{item['_id']}:**\n"
-                response += f"   - Total: ${item['total']:,.2f}\n"
-                response += f"   - Count: {item['count']:,}\n"
-                response += f"   - Average: ${item['avg']:,.2f}\n"
-                response += f"   - Maximum: ${item['max']:,.2f}\n\n"
-            return response
+            row = f"**{item['_id']}:**\n"
+            row += f"   - Total: ${item['total']:,.2f}\n"
+            row += f"   - Count: {item['count']:,}\n"
+            row += f"   - Average: ${item['avg']:,.2f}\n"
+            row += f"   - Maximum: ${item['max']:,.2f}\n\n"
+            return row
             
         elif query_type == 'top_items':
-            response = "## Items with Highest Sales:\n\n"
-            for i, item in enumerate(results, 1):
-                if item['_id']:
-                    response += f"**{i}. {item['_id']}**\n"
-                    response += f"   - Total Sales: ${item['total_sales']:,.2f}\n"
-                    response += f"   - Quantity: {item['quantity']:,.0f}\n"
-                    response += f"   - Orders: {item['orders']}\n\n"
-            return response
+            if not item['_id']:
+                return ""
+            row = f"**{i}. {item['_id']}**\n"
+            row += f"   - Total Sales: ${item['total_sales']:,.2f}\n"
+            row += f"   - Quantity: {item['quantity']:,.0f}\n"
+            row += f"   - Orders: {item['orders']}\n\n"
+            return row
             
         elif query_type == 'frequency':
-            response = "## Most Frequently Ordered Items:\n\n"
-            for i, item in enumerate(results, 1):
-                if item['_id']:
-                    response += f"**{i}. {item['_id']}**\n"
-                    response += f"   - Ordered {item['frequency']} times\n"
-                    response += f"   - Total Quantity: {item.get('total_quantity', 0):,.0f}\n"
-                    response += f"   - Total Spent: ${item['total_spent']:,.2f}\n\n"
-            return response
+            if not item['_id']:
+                return ""
+            row = f"**{i}. {item['_id']}**\n"
+            row += f"   - Ordered {item['frequency']} times\n"
+            row += f"   - Total Quantity: {item.get('total_quantity', 0):,.0f}\n"
+            row += f"   - Total Spent: ${item['total_spent']:,.2f}\n\n"
+            return row
             
         elif query_type == 'top_departments':
-            response = "## Top Departments by Spending:\n\n"
-            for i, item in enumerate(results, 1):
-                response += f"**{i}. {item['_id']}**\n"
-                response += f"   - Total: ${item['total']:,.2f}\n"
-                response += f"   - Orders: {item['count']:,}\n"
-                response += f"   - Average Purchase: ${item['avg_purchase']:,.2f}\n\n"
-            return response
+            row = f"**{i}. {item['_id']}**\n"
+            row += f"   - Total: ${item['total']:,.2f}\n"
+            row += f"   - Orders: {item['count']:,}\n"
+            row += f"   - Average Purchase: ${item['avg_purchase']:,.2f}\n\n"
+            return row
             
         elif query_type == 'top_suppliers':
-            response = "## Top Suppliers by Revenue:\n\n"
-            for i, item in enumerate(results, 1):
-                response += f"**{i}. {item['_id']}**\n"
-                response += f"   - Total Revenue: ${item['total']:,.2f}\n"
-                response += f"   - Orders: {item['count']:,}\n"
-                response += f"   - Average Order: ${item['avg_order']:,.2f}\n\n"
-            return response
+            row = f"**{i}. {item['_id']}**\n"
+            row += f"   - Total Revenue: ${item['total']:,.2f}\n"
+            row += f"   - Orders: {item['count']:,}\n"
+            row += f"   - Average Order: ${item['avg_order']:,.2f}\n\n"
+            return row
+            
+        elif query_type == 'percentile':
+            percentile = item['percentile']
+            label = "Median" if percentile == 50 else f"{ordinal(percentile)} Percentile"
+            note = "estimated from precomputed sketches" if item['source'] == 'sketch' else "exact"
+            row = f"**{label} Purchase Amount:** ${item['value']:,.2f}\n\n"
+            row += f"_Based on {item['count']:,} purchases ({note})_"
+            return row
+            
+        elif query_type == 'histogram':
+            row = f"**{item['range']}:** {item['count']:,} purchases ({item['share']:.1%})\n\n"
+            return row
+            
+        elif query_type == 'cube':
+            label = " · ".join(
+                f"{DIMENSION_LABELS[dim]}: {item[dim]}" for dim in item if dim in DIMENSION_LABELS
+            )
+            row = f"**{i}. {label or 'All purchases'}**\n"
+            row += f"   - Total: ${item['sum']:,.2f}\n"
+            row += f"   - Orders: {item['count']:,}\n"
+            row += f"   - Average: ${item['avg']:,.2f}\n"
+            row += f"   - Range: ${item['min']:,.2f} - ${item['max']:,.2f}\n\n"
+            return row
             
         elif query_type == 'acquisition_methods':
-            response = "## Acquisition Methods Analysis:\n\n"
-            for item in results[:10]:
-                if item['_id']:
-                    response += f"**{item['_id']}:**\n"
-                    response += f"   - Orders: {item['count']:,}\n"
-                    response += f"   - Total: ${item['total']:,.2f}\n"
-                    response += f"   - Average: ${item['avg']:,.2f}\n\n"
-            return response
+            if not item['_id']:
+                return ""
+            row = f"**{item['_id']}:**\n"
+            row += f"   - Orders: {item['count']:,}\n"
+            row += f"   - Total: ${item['total']:,.2f}\n"
+            row += f"   - Average: ${item['avg']:,.2f}\n\n"
+            return row
             
         else:
-            # Generic list response
-            response = "## Query Results:\n\n"
-            for i, item in enumerate(results[:10], 1):
-                response += f"{i}. Item: {item.get('Item Name', 'N/A')}\n"
-                response += f"   Price: ${item.get('Total Price', 0):,.2f}\n\n"
-            return response
+            # Generic list row
+            row = f"{i}. Item: {item.get('Item Name', 'N/A')}\n"
+            row += f"   Price: ${item.get('Total Price', 0):,.2f}\n\n"
+            return row
             
+    def format_response(self, results, query_info, question):
+        """Format results into readable response"""
+        if not results:
+            return NO_RESULTS_MESSAGE
+            
+        query_type = query_info.get('query_type')
+        
+        if query_type in SCALAR_QUERY_TYPES:
+            return self.format_row(results[0], 1, query_type)
+        
+        limit = ROW_LIMITS.get(query_type)
+        response = self.format_header(query_type)
+        for i, item in enumerate(results[:limit], 1):
+            response += self.format_row(item, i, query_type)
+        return response
+    
+    def read_data_version(self):
+        """Version stamp written by data_loader.py on every reload"""
+        doc = self.db[MONGODB_CONFIG['metadata_collection']].find_one({'_id': 'data_version'})
+        return doc.get('loaded_at') if doc else None
+    
+    def check_data_version(self, force=False):
+        """Drop cached answers if the data was reloaded; returns True when it was"""
+        with self.version_lock:
+            now = time.monotonic()
+            if not force and now - self.data_version_checked < CACHE_CONFIG['version_check_interval']:
+                return False
+            self.data_version_checked = now
+            
+            try:
+                version = self.read_data_version()
+            except Exception as e:
+                print(f"Data version check error: {e}")
+                return False
+            
+            if version == self.data_version:
+                return False
+            changed = self.data_version is not None
+            self.data_version = version
+            self.answer_cache.clear()
+            self.partitions = None
+            self.cube = None
+            return changed
+    
+    def cached_answer(self, key):
+        """Cached answer computed from the current data version, or None"""
+        entry = self.answer_cache.get(key)
+        if entry is None or entry[0] != self.data_version:
+            return None
+        return entry[1]
+    
+    def cache_answer(self, key, version, query_info, response):
+        """Cache an answer unless the data was reloaded while it was being computed,
+        or it came from the list fallback after a failed LLM classification"""
+        if version == self.data_version and not query_info.get('fallback'):
+            self.answer_cache.put(key, (version, response))
+    
+    def log_question(self, question):
+        """Count a user question so the most frequent ones can be pre-warmed"""
+        try:
+            self.db[MONGODB_CONFIG['query_log_collection']].update_one(
+                {'_id': self.cache_key(question)},
+                {'$inc': {'count': 1}, '$set': {'question': question, 'last_asked': datetime.now()}},
+                upsert=True
+            )
+        except Exception as e:
+            print(f"Query log error: {e}")
+    
+    def frequent_questions(self, limit):
+        """Most frequently asked questions from the query log"""
+        try:
+            log = self.db[MONGODB_CONFIG['query_log_collection']]
+            return [doc['question'] for doc in log.find().sort('count', -1).limit(limit)]
+        except Exception as e:
+            print(f"Query log error: {e}")
+            return []
+    
     def answer_question(self, question):
         """Main entry point for answering questions"""
+        self.check_data_version()
+        version = self.data_version
+        key = self.cache_key(question)
+        cached = self.cached_answer(key)
+        if cached is not None:
+            return cached
+        
         try:
-            # Understand the query
-            query_info = self.understand_query(question)
-            
-            # Generate MongoDB pipeline
-            pipeline = self.generate_mongodb_query(query_info)
+            # Understand the query and generate the MongoDB pipeline
+            query_info, pipeline = self.plan_query(question)
             
             # Execute query
-            results = self.execute_query(pipeline)
+            results = self.run_query(query_info, pipeline)
             
             # Format and return response
-            return self.format_response(results, query_info, question)
+            response = self.format_response(results, query_info, question)
+            if results is not None:
+                self.cache_answer(key, version, query_info, response)
+            return response
             
         except Exception as e:
-            return f"An error occurred while processing your question: {str(e)}\n\nPlease try rephrasing your question."
\ No newline at end of file
+            return f"An error occurred while processing your question: {str(e)}\n\nPlease try rephrasing your question."
+            
+    def answer_question_stream(self, question):
+        """Answer a question incrementally, yielding markdown as rows arrive"""
+        self.check_data_version()
+        version = self.data_version
+        key = self.cache_key(question)
+        cached = self.cached_answer(key)
+        if cached is not None:
+            yield cached
+            return
+        
+        try:
+            query_info, pipeline = self.plan_query(question)
+            
+            parts = []
+            for chunk in self.stream_answer(query_info, pipeline):
+                parts.append(chunk)
+                yield chunk
+            self.cache_answer(key, version, query_info, ''.join(parts))
+            
+        except Exception as e:
+            yield f"An error occurred while processing your question: {str(e)}\n\nPlease try rephrasing your question."
+    
+    def stream_answer(self, query_info, pipeline):
+        """Yield the header and formatted rows as the cursor delivers them"""
+        query_type = query_info.get('query_type')
+        
+        if query_type in IN_MEMORY_QUERY_TYPES:
+            results = self.run_query(query_info, pipeline)
+            if results is None:
+                # Surfaced as an error so the failure isn't cached as "no results"
+                raise RuntimeError("The query could not be completed")
+            rows = (doc for doc in results)
+        else:
+            rows = self.stream_query(pipeline)
+        try:
+            first = next(rows, None)
+            if first is None:
+                yield NO_RESULTS_MESSAGE
+                return
+            
+            if query_type in SCALAR_QUERY_TYPES:
+                yield self.format_row(first, 1, query_type)
+                return
+            
+            yield self.format_header(query_type)
+            yield self.format_row(first, 1, query_type)
+            
+            limit = ROW_LIMITS.get(query_type)
+            for i, item in enumerate(rows, 2):
+                if limit is not None and i > limit:
+                    break
+                yield self.format_row(item, i, query_type)
+        finally:
+            # Close the cursor even when the consumer stops early
+            rows.close()
+    
+    def export_query(self, question, fmt='csv', chunk_size=None):
+        """Stream a question's full result set (no row limit) as CSV or Parquet bytes"""
+        chunk_size = chunk_size or EXPORT_CONFIG['chunk_size']
+        query_info, pipeline = self.plan_query(question)
+        
+        # Drop the display limit so the export covers every matching row
+        pipeline = list(pipeline)
+        while pipeline and '$limit' in pipeline[-1]:
+            pipeline.pop()
+        
+        if query_info.get('query_type') in IN_MEMORY_QUERY_TYPES:
+            results = self.run_query(query_info, pipeline)
+            if results is None:
+                raise RuntimeError("The query could not be completed")
+            docs = iter(results)
+        else:
+            docs = self.stream_query(pipeline, batch_size=chunk_size)
+        return export_chunks(docs, fmt, chunk_size)
\ No newline at end of file
@@ -0,0 +1,248 @@
+"""
+Partitions - Year-partitioned purchase collections and fan-out aggregation
+"""
+import re
+import heapq
+from functools import cmp_to_key
+from itertools import chain, islice
+from config import MONGODB_CONFIG
+
+# Accumulators whose partial results can be merged across partitions
+MERGEABLE_ACCUMULATORS = ('$sum', '$max', '$min', '$avg')
+
+
+def partition_name(fiscal_year):
+    """Collection name for one fiscal year, e.g. purchases_fy_2013_2014"""
+    suffix = re.sub(r'[^0-9A-Za-z]+', '_', str(fiscal_year)).strip('_') or 'unknown'
+    return MONGODB_CONFIG['partition_prefix'] + suffix
+
+
+def partition_collections(db):
+    """Map fiscal year -> collection for every partition in the database"""
+    prefix = MONGODB_CONFIG['partition_prefix']
+    partitions = {}
+    for name in sorted(db.list_collection_names()):
+        if name.startswith(prefix):
+            fiscal_year = name[len(prefix):].replace('_', '-')
+            partitions[fiscal_year] = db[name]
+    return partitions
+
+
+def source_collections(db):
+    """Collections that hold purchase records under the configured layout"""
+    if MONGODB_CONFIG['partitioned']:
+        return list(partition_collections(db).values())
+    return [db[MONGODB_CONFIG['collection']]]
+
+
+def prune_partitions(partitions, pipeline):
+    """Keep only the partitions a leading Fiscal Year $match can touch"""
+    if pipeline and '$match' in pipeline[0]:
+        fiscal_year = pipeline[0]['$match'].get('Fiscal Year')
+        if isinstance(fiscal_year, str):
+            collection = partitions.get(fiscal_year)
+            return [collection] if collection is not None else []
+    return list(partitions.values())
+
+
+def is_row_pipeline(pipeline):
+    """True when results don't depend on ordering or grouping across partitions"""
+    order_stages = ('$group', '$count', '$sort', '$limit', '$skip')
+    return not any(op in stage for stage in pipeline for op in order_stages)
+
+
+def get_path(doc, path):
+    """Read a dotted field path from a document"""
+    value = doc
+    for part in path.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def _sort_value(doc, path):
+    value = get_path(doc, path)
+    return (value is not None, value)
+
+
+def compare_documents(a, b, spec):
+    """Order two documents by a $sort specification (nulls sort lowest, like MongoDB)"""
+    for path, direction in spec.items():
+        left, right = _sort_value(a, path), _sort_value(b, path)
+        if left != right:
+            return direction if left > right else -direction
+    return 0
+
+
+def sort_documents(docs, spec):
+    """Apply a $sort specification in Python (nulls sort lowest, like MongoDB)"""
+    for path, direction in reversed(list(spec.items())):
+        docs.sort(
+            key=lambda doc: (get_path(doc, path) is not None, get_path(doc, path)),
+            reverse=direction < 0
+        )
+    return docs
+
+
+def apply_tail(docs, stages):
+    """Apply trailing $sort / $limit stages to merged results"""
+    for stage in stages:
+        if '$sort' in stage:
+            sort_documents(docs, stage['$sort'])
+        elif '$limit' in stage:
+            docs = docs[:stage['$limit']]
+    return docs
+
+
+def _is_tail(stages):
+    return all(set(stage) <= {'$sort', '$limit'} for stage in stages)
+
+
+def _group_key(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k, _group_key(v)) for k, v in value.items()))
+    return value
+
+
+def split_pipeline(pipeline):
+    """Split a pipeline for fan-out.
+
+    Returns (kind, partial_pipeline, tail, info) where kind is 'group',
+    'count' or 'rows', or None when the pipeline can't be merged.
+    """
+    for i, stage in enumerate(pipeline):
+        if '$group' in stage:
+            tail = pipeline[i + 1:]
+            if not _is_tail(tail):
+                return None
+            partial_group = {'_id': stage['$group']['_id']}
+            accumulators = {}
+            for field, expr in stage['$group'].items():
+                if field == '_id':
+                    continue
+                op, arg = next(iter(expr.items()))
+                if op not in MERGEABLE_ACCUMULATORS:
+                    return None
+                accumulators[field] = op
+                if op == '$avg':
+                    partial_group[field + '__sum'] = {'$sum': arg}
+                    partial_group[field + '__count'] = {'$sum': {'$cond': [{'$isNumber': arg}, 1, 0]}}
+                else:
+                    partial_group[field] = {op: arg}
+            return 'group', pipeline[:i] + [{'$group': partial_group}], tail, accumulators
+
+        if '$count' in stage:
+            if pipeline[i + 1:]:
+                return None
+            return 'count', pipeline[:i + 1], [], stage['$count']
+
+        if '$sort' in stage or '$limit' in stage:
+            tail = pipeline[i:]
+            if not _is_tail(tail):
+                return None
+            return 'rows', pipeline, tail, None
+
+    return 'rows', pipeline, [], None
+
+
+def merge_groups(partials, accumulators):
+    """Combine partial $group results from several partitions"""
+    merged = {}
+    for docs in partials:
+        for doc in docs:
+            key = _group_key(doc['_id'])
+            target = merged.get(key)
+            if target is None:
+                merged[key] = dict(doc)
+                continue
+            for field, op in accumulators.items():
+                if op == '$avg':
+                    target[field + '__sum'] += doc[field + '__sum']
+                    target[field + '__count'] += doc[field + '__count']
+                elif op == '$sum':
+                    target[field] += doc[field]
+                elif doc[field] is not None:
+                    if target[field] is None:
+                        target[field] = doc[field]
+                    elif op == '$max':
+                        target[field] = max(target[field], doc[field])
+                    else:
+                        target[field] = min(target[field], doc[field])
+
+    results = []
+    for doc in merged.values():
+        for field, op in accumulators.items():
+            if op == '$avg':
+                total = doc.pop(field + '__sum')
+                count = doc.pop(field + '__count')
+                doc[field] = total / count if count else None
+        results.append(doc)
+    return results
+
+
+def sorted_rows_plan(pipeline):
+    """(sort spec or None, limit or None) for a row pipeline ending in $sort / $limit, else None"""
+    split = split_pipeline(pipeline)
+    if split is None or split[0] != 'rows':
+        return None
+    tail = split[2]
+    spec, limit = None, None
+    for stage in tail:
+        if '$sort' in stage and spec is None and limit is None:
+            spec = stage['$sort']
+        elif '$limit' in stage and limit is None:
+            limit = stage['$limit']
+        else:
+            return None
+    return spec, limit
+
+
+def merge_sorted_partitions(collections, pipeline, spec, limit, executor, batch_size):
+    """Stream a sorted row pipeline from several partitions with a k-way merge of their cursors"""
+    def open_cursor(collection):
+        return collection.aggregate(pipeline, allowDiskUse=True, batchSize=batch_size)
+
+    cursors = list(executor.map(open_cursor, collections))
+    try:
+        if spec is None:
+            docs = chain.from_iterable(cursors)
+        else:
+            docs = heapq.merge(*cursors, key=cmp_to_key(lambda a, b: compare_documents(a, b, spec)))
+        yield from islice(docs, limit)
+    finally:
+        for cursor in cursors:
+            cursor.close()
+
+
+def union_pipeline(collections, pipeline):
+    """Run a non-mergeable pipeline over all partitions with $unionWith"""
+    first, rest = collections[0], collections[1:]
+    union = [{'$unionWith': {'coll': c.name}} for c in rest]
+    return first, union + pipeline
+
+
+def fan_out_aggregate(collections, pipeline, executor):
+    """Aggregate over several partitions concurrently and merge the partial results"""
+    if not collections:
+        return []
+    if len(collections) == 1:
+        return list(collections[0].aggregate(pipeline, allowDiskUse=True))
+
+    split = split_pipeline(pipeline)
+    if split is None:
+        collection, union = union_pipeline(collections, pipeline)
+        return list(collection.aggregate(union, allowDiskUse=True))
+    kind, partial, tail, info = split
+
+    def run(collection):
+        return list(collection.aggregate(partial, allowDiskUse=True))
+
+    partials = list(executor.map(run, collections))
+
+    if kind == 'count':
+        total = sum(docs[0][info] for docs in partials if docs)
+        return [{info: total}] if total else []
+    if kind == 'group':
+        return apply_tail(merge_groups(partials, info), tail)
+    return apply_tail([doc for docs in partials for doc in docs], tail)
@@ -0,0 +1,53 @@
+"""
+Cache Prewarmer - Fills the agent's answer cache with hot questions in the background
+"""
+import threading
+from config import PREWARM_CONFIG
+
+
+class CachePrewarmer:
+    def __init__(self, agent, questions):
+        self.agent = agent
+        self.questions = list(questions)
+        self.warmed_version = None
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="cache-prewarmer", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+
+    def hot_questions(self):
+        """Configured questions followed by the most frequently logged ones"""
+        logged = self.agent.frequent_questions(PREWARM_CONFIG['top_logged_questions'])
+        seen = set()
+        hot = []
+        for question in self.questions + logged:
+            key = self.agent.cache_key(question)
+            if key not in seen:
+                seen.add(key)
+                hot.append(question)
+        return hot
+
+    def warm(self):
+        """Answer every hot question once so later requests hit the cache"""
+        self.warmed_version = self.agent.data_version
+        for question in self.hot_questions():
+            if self.stop_event.is_set():
+                return
+            try:
+                self.agent.answer_question(question)
+            except Exception as e:
+                print(f"Prewarm error for '{question}': {e}")
+
+    def run(self):
+        """Warm at startup, then again whenever the data is reloaded"""
+        self.agent.check_data_version(force=True)
+        self.warm()
+        while not self.stop_event.wait(PREWARM_CONFIG['check_interval']):
+            self.agent.check_data_version(force=True)
+            if self.agent.data_version != self.warmed_version:
+                self.warm()
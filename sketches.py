@@ -0,0 +1,133 @@
+"""
+Price Sketches - Mergeable t-digest + histogram summaries of purchase prices
+"""
+import math
+import numpy as np
+from config import SKETCH_CONFIG
+
+# Histogram bucket edges for purchase amounts (log scale)
+HISTOGRAM_EDGES = [-math.inf, 0, 100, 1e3, 1e4, 1e5, 1e6, 1e7, math.inf]
+HISTOGRAM_LABELS = [
+    "Below $0",
+    "$0 - $100",
+    "$100 - $1K",
+    "$1K - $10K",
+    "$10K - $100K",
+    "$100K - $1M",
+    "$1M - $10M",
+    "$10M+"
+]
+
+# Dimensions sketches are precomputed for: name -> source column
+SKETCH_DIMENSIONS = {
+    'fiscal_year': 'Fiscal Year',
+    'department': 'Department Name'
+}
+
+
+def histogram_counts(values):
+    """Exact counts of values per histogram bucket"""
+    edges = np.asarray(HISTOGRAM_EDGES[1:-1])
+    buckets = np.searchsorted(edges, values, side='right')
+    return np.bincount(buckets, minlength=len(HISTOGRAM_LABELS)).astype(np.int64)
+
+
+def _compress(means, weights, compression):
+    """Merge sorted centroids so each one spans at most one unit of the k1 scale"""
+    total = weights.sum()
+    q = (np.cumsum(weights) - weights / 2) / total
+    k = compression / (2 * math.pi) * np.arcsin(2 * q - 1)
+    buckets = np.floor(k + compression / 4).astype(np.int64)
+
+    starts = np.flatnonzero(np.r_[True, np.diff(buckets) != 0])
+    new_weights = np.add.reduceat(weights, starts)
+    new_means = np.add.reduceat(means * weights, starts) / new_weights
+    return new_means, new_weights
+
+
+class PriceSketch:
+    def __init__(self, means, weights, minimum, maximum, histogram):
+        self.means = means
+        self.weights = weights
+        self.min = minimum
+        self.max = maximum
+        self.histogram = histogram
+
+    @property
+    def count(self):
+        return int(self.histogram.sum())
+
+    @classmethod
+    def from_values(cls, values, compression=None):
+        """Summarize an array of prices"""
+        values = np.sort(np.asarray(values, dtype=float))
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return None
+        means, weights = _compress(values, np.ones(len(values)), compression or SKETCH_CONFIG['compression'])
+        return cls(means, weights, float(values[0]), float(values[-1]), histogram_counts(values))
+
+    @classmethod
+    def merge(cls, sketches, compression=None):
+        """Combine several sketches into one"""
+        sketches = [s for s in sketches if s is not None]
+        if not sketches:
+            return None
+        means = np.concatenate([s.means for s in sketches])
+        weights = np.concatenate([s.weights for s in sketches])
+        order = np.argsort(means, kind='stable')
+        means, weights = _compress(means[order], weights[order], compression or SKETCH_CONFIG['compression'])
+        return cls(
+            means,
+            weights,
+            min(s.min for s in sketches),
+            max(s.max for s in sketches),
+            sum(s.histogram for s in sketches)
+        )
+
+    def quantile(self, q):
+        """Approximate value at quantile q (0-1)"""
+        total = self.weights.sum()
+        centers = np.cumsum(self.weights) - self.weights / 2
+        positions = np.r_[0, centers, total]
+        values = np.r_[self.min, self.means, self.max]
+        return float(np.interp(q * total, positions, values))
+
+    def to_document(self):
+        return {
+            'means': self.means.tolist(),
+            'weights': self.weights.tolist(),
+            'min': self.min,
+            'max': self.max,
+            'histogram': self.histogram.tolist()
+        }
+
+    @classmethod
+    def from_document(cls, doc):
+        return cls(
+            np.asarray(doc['means'], dtype=float),
+            np.asarray(doc['weights'], dtype=float),
+            doc['min'],
+            doc['max'],
+            np.asarray(doc['histogram'], dtype=np.int64)
+        )
+
+
+def build_price_sketches(df):
+    """Yield sketch documents per fiscal year, and per fiscal year x department"""
+    for dimension, column in SKETCH_DIMENSIONS.items():
+        if column not in df.columns:
+            continue
+        keys = ['Fiscal Year'] if dimension == 'fiscal_year' else ['Fiscal Year', column]
+        for group_key, prices in df.groupby(keys)['Total Price']:
+            if not isinstance(group_key, tuple):
+                group_key = (group_key,)
+            sketch = PriceSketch.from_values(prices.to_numpy())
+            if sketch is None:
+                continue
+            yield {
+                'dimension': dimension,
+                'fiscal_year': group_key[0],
+                'key': group_key[-1],
+                'sketch': sketch.to_document()
+            }
@@ -0,0 +1,203 @@
+"""
+Spend Cube - In-memory aggregate lattice (sum, count, min, max) over spending dimensions
+"""
+import os
+import re
+from itertools import combinations
+import numpy as np
+import pandas as pd
+from config import CUBE_CONFIG
+
+# Cube dimensions in canonical order
+DIMENSIONS = ('fiscal_year', 'quarter', 'month', 'department', 'supplier', 'acquisition_method')
+
+DIMENSION_COLUMNS = {
+    'fiscal_year': 'Fiscal Year',
+    'department': 'Department Name',
+    'supplier': 'Supplier Name',
+    'acquisition_method': 'Acquisition Method'
+}
+
+DIMENSION_LABELS = {
+    'fiscal_year': 'Fiscal Year',
+    'quarter': 'Fiscal Quarter',
+    'month': 'Month',
+    'department': 'Department',
+    'supplier': 'Supplier',
+    'acquisition_method': 'Acquisition Method'
+}
+
+# Fiscal quarters follow the California fiscal year (FQ1 = Jul-Sep). They are
+# labelled FQ so they can't be confused with the calendar quarters (Q1 = Jan-Mar)
+# used everywhere else in the agent.
+QUARTER_LABELS = ['FQ1', 'FQ2', 'FQ3', 'FQ4']
+
+# Fiscal quarter for each calendar month, and for each calendar quarter
+FISCAL_QUARTER_BY_MONTH = ['FQ3', 'FQ3', 'FQ3', 'FQ4', 'FQ4', 'FQ4', 'FQ1', 'FQ1', 'FQ1', 'FQ2', 'FQ2', 'FQ2']
+FISCAL_QUARTER_BY_CALENDAR_QUARTER = {'Q1': 'FQ3', 'Q2': 'FQ4', 'Q3': 'FQ1', 'Q4': 'FQ2'}
+MONTH_LABELS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+UNKNOWN = 'Unknown'
+
+
+def _encode(values, labels=None):
+    """Dictionary-encode values; returns (int32 codes, label array)"""
+    values = pd.Series(values).fillna(UNKNOWN).astype(str)
+    if labels is None:
+        codes, uniques = pd.factorize(values, sort=True)
+        return codes.astype(np.int32), np.asarray(uniques, dtype=str)
+    labels = list(labels) + [UNKNOWN]
+    codes = pd.Categorical(values, categories=labels).codes
+    codes = np.where(codes < 0, len(labels) - 1, codes)
+    return codes.astype(np.int32), np.asarray(labels, dtype=str)
+
+
+def _rollup(codes, sizes, sums, counts, mins, maxs):
+    """Group rows by their code tuples and combine the measures"""
+    if codes.shape[1] == 0:
+        keys = np.zeros(len(sums), dtype=np.int64)
+    else:
+        keys = np.ravel_multi_index(codes.T, sizes)
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, np.diff(keys) != 0])
+
+    cuboid = {
+        'codes': codes[order][starts],
+        'sum': np.add.reduceat(sums[order], starts),
+        'count': np.add.reduceat(counts[order], starts),
+        'min': np.minimum.reduceat(mins[order], starts),
+        'max': np.maximum.reduceat(maxs[order], starts)
+    }
+    return cuboid
+
+
+class SpendCube:
+    def __init__(self, dictionaries, cuboids):
+        self.dictionaries = dictionaries
+        self.cuboids = cuboids
+
+    @classmethod
+    def build(cls, df, max_cells=None):
+        """Build the lattice from a purchases DataFrame"""
+        max_cells = max_cells or CUBE_CONFIG['max_cells']
+        dates = pd.to_datetime(df['Creation Date'], errors='coerce')
+        month = dates.dt.month
+
+        columns = {
+            'quarter': month.map(lambda m: FISCAL_QUARTER_BY_MONTH[int(m) - 1], na_action='ignore'),
+            'month': month.map(lambda m: MONTH_LABELS[int(m) - 1], na_action='ignore')
+        }
+        for dim, column in DIMENSION_COLUMNS.items():
+            columns[dim] = df[column] if column in df.columns else pd.Series([None] * len(df))
+
+        dictionaries = {}
+        codes = []
+        for dim in DIMENSIONS:
+            labels = {'quarter': QUARTER_LABELS, 'month': MONTH_LABELS}.get(dim)
+            dim_codes, dictionaries[dim] = _encode(columns[dim].to_numpy(), labels)
+            codes.append(dim_codes)
+        codes = np.column_stack(codes)
+
+        prices = pd.to_numeric(df['Total Price'], errors='coerce').fillna(0).to_numpy(dtype=float)
+        sizes = [len(dictionaries[dim]) for dim in DIMENSIONS]
+        base = _rollup(codes, sizes, prices, np.ones(len(prices), dtype=np.int64), prices, prices)
+
+        # Derive each cuboid from its smallest stored ancestor; keep only compact ones
+        cuboids = {DIMENSIONS: base}
+        for size in range(len(DIMENSIONS) - 1, -1, -1):
+            for dims in combinations(DIMENSIONS, size):
+                parent_dims = min(
+                    (d for d in cuboids if set(dims) <= set(d)),
+                    key=lambda d: len(cuboids[d]['sum'])
+                )
+                cuboid = cls._project(cuboids[parent_dims], parent_dims, dims, dictionaries)
+                if len(cuboid['sum']) <= max_cells:
+                    cuboids[dims] = cuboid
+        return cls(dictionaries, cuboids)
+
+    @staticmethod
+    def _project(cuboid, parent_dims, dims, dictionaries):
+        """Roll a cuboid up to a subset of its dimensions"""
+        columns = [parent_dims.index(dim) for dim in dims]
+        sizes = [len(dictionaries[dim]) for dim in dims]
+        return _rollup(
+            cuboid['codes'][:, columns], sizes,
+            cuboid['sum'], cuboid['count'], cuboid['min'], cuboid['max']
+        )
+
+    def _codes_matching(self, dim, value):
+        """Dictionary codes selected by a filter value (label, list of labels or regex)"""
+        labels = self.dictionaries[dim]
+        if isinstance(value, re.Pattern):
+            return np.flatnonzero([bool(value.search(label)) for label in labels])
+        if isinstance(value, str):
+            value = [value]
+        return np.flatnonzero(np.isin(labels, list(value)))
+
+    def query(self, group_by=(), where=None, limit=None):
+        """Roll up or slice the cube.
+
+        group_by lists dimensions to break spending down by; where maps
+        dimensions to a label, a list of labels or a compiled regex.
+        Rows come back as dicts sorted by total spending, highest first,
+        with dimension values in group_by order.
+        """
+        where = where or {}
+        group_by = [dim for dim in dict.fromkeys(group_by) if dim in DIMENSIONS]
+        needed = set(group_by) | set(where)
+        source_dims = min(
+            (d for d in self.cuboids if needed <= set(d)),
+            key=lambda d: len(self.cuboids[d]['sum'])
+        )
+        cuboid = self.cuboids[source_dims]
+
+        mask = np.ones(len(cuboid['sum']), dtype=bool)
+        for dim, value in where.items():
+            column = cuboid['codes'][:, source_dims.index(dim)]
+            mask &= np.isin(column, self._codes_matching(dim, value))
+        if not mask.any():
+            return []
+        if not mask.all():
+            cuboid = {key: array[mask] for key, array in cuboid.items()}
+
+        result = self._project(cuboid, source_dims, tuple(group_by), self.dictionaries)
+
+        order = np.argsort(-result['sum'], kind='stable')
+        if limit is not None:
+            order = order[:limit]
+        rows = []
+        for i in order:
+            row = {dim: str(self.dictionaries[dim][result['codes'][i, j]]) for j, dim in enumerate(group_by)}
+            row.update({
+                'sum': float(result['sum'][i]),
+                'count': int(result['count'][i]),
+                'min': float(result['min'][i]),
+                'max': float(result['max'][i]),
+                'avg': float(result['sum'][i] / result['count'][i])
+            })
+            rows.append(row)
+        return rows
+
+    def save(self, path):
+        """Store dictionaries and stored cuboids in a compressed .npz file"""
+        arrays = {f"dict__{dim}": labels for dim, labels in self.dictionaries.items()}
+        for dims, cuboid in self.cuboids.items():
+            name = '+'.join(dims) or 'all'
+            for key, array in cuboid.items():
+                arrays[f"cuboid__{name}__{key}"] = array
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            dictionaries = {}
+            cuboids = {}
+            for name in data.files:
+                parts = name.split('__')
+                if parts[0] == 'dict':
+                    dictionaries[parts[1]] = data[name]
+                else:
+                    dims = () if parts[1] == 'all' else tuple(parts[1].split('+'))
+                    cuboids.setdefault(dims, {})[parts[2]] = data[name]
+        return cls(dictionaries, cuboids)
@@ -0,0 +1,81 @@
+"""
+Shared fixtures - local stub of the Ollama /api/generate endpoint
+"""
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class StubOllama:
+    """Serves a scripted NDJSON reply as chunked transfer encoding, like Ollama does"""
+
+    def __init__(self):
+        self.tokens = ['{"query_type": "sum"}']
+        self.first_byte_delay = 0
+        self.chunk_delay = 0
+        self.calls = 0
+        self.prompts = []
+
+    def reply(self, tokens, first_byte_delay=0, chunk_delay=0):
+        self.tokens = tokens
+        self.first_byte_delay = first_byte_delay
+        self.chunk_delay = chunk_delay
+
+
+def make_handler(stub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            stub.calls += 1
+            stub.prompts.append(json.loads(body)['prompt'])
+            time.sleep(stub.first_byte_delay)
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            try:
+                lines = [{'response': token, 'done': False} for token in stub.tokens]
+                lines.append({'response': '', 'done': True})
+                for line in lines:
+                    data = (json.dumps(line) + '\n').encode('utf-8')
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+                    self.wfile.flush()
+                    time.sleep(stub.chunk_delay)
+                self.wfile.write(b'0\r\n\r\n')
+            except (BrokenPipeError, ConnectionResetError):
+                # The client gave up (timeout or deadline)
+                pass
+
+        def handle(self):
+            try:
+                super().handle()
+            except ConnectionResetError:
+                # Keep-alive connection dropped when the client closed its session
+                pass
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+@pytest.fixture
+def ollama_stub():
+    stub = StubOllama()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(stub))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    stub.url = f"http://127.0.0.1:{server.server_address[1]}/api/generate"
+    yield stub
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,73 @@
+"""
+Tests for the version-tagged answer cache
+"""
+import pytest
+from ollama_agent import OllamaAgent
+
+QUESTION = "What is the total spending?"
+
+
+@pytest.fixture
+def agent(monkeypatch):
+    agent = OllamaAgent()
+    state = {'version': 1, 'total': 100.0, 'queries': 0}
+
+    def run_query(query_info, pipeline):
+        state['queries'] += 1
+        total = state['total']
+        if 'reload_during_query' in state:
+            # Data reloaded after the query read the old records
+            state.update(state.pop('reload_during_query'))
+            agent.check_data_version(force=True)
+        return [{'total': total}]
+
+    monkeypatch.setattr(agent, 'read_data_version', lambda: state['version'])
+    monkeypatch.setattr(agent, 'run_query', run_query)
+    monkeypatch.setattr(agent, 'stream_query', lambda pipeline: (doc for doc in run_query(None, pipeline)))
+    agent.state = state
+    yield agent
+    agent.client.close()
+    agent.executor.shutdown(wait=False)
+
+
+@pytest.mark.parametrize('answer', [
+    OllamaAgent.answer_question,
+    lambda agent, question: ''.join(agent.answer_question_stream(question)),
+])
+def test_answer_from_before_a_reload_is_not_cached(agent, answer):
+    agent.state['reload_during_query'] = {'version': 2, 'total': 200.0}
+
+    assert answer(agent, QUESTION) == "**Total Spending:** $100.00"
+    assert answer(agent, QUESTION) == "**Total Spending:** $200.00"
+    assert answer(agent, QUESTION) == "**Total Spending:** $200.00"
+    assert agent.state['queries'] == 2
+
+
+def test_reload_invalidates_cached_answers(agent):
+    agent.answer_question(QUESTION)
+    agent.answer_question(QUESTION)
+    assert agent.state['queries'] == 1
+
+    agent.state.update(version=2, total=300.0)
+    agent.check_data_version(force=True)
+
+    assert agent.answer_question(QUESTION) == "**Total Spending:** $300.00"
+    assert agent.state['queries'] == 2
+
+
+def test_stale_entry_is_rejected_on_get(agent):
+    agent.check_data_version(force=True)
+    agent.answer_cache.put(agent.cache_key(QUESTION), (0, "stale"))
+
+    assert agent.answer_question(QUESTION) == "**Total Spending:** $100.00"
+
+
+def test_failed_sketch_query_is_not_cached(agent, monkeypatch):
+    monkeypatch.setattr(agent, 'run_query', lambda query_info, pipeline: None)
+
+    response = ''.join(agent.answer_question_stream("What is the median purchase?"))
+
+    assert response.startswith("An error occurred")
+    assert agent.cached_answer(agent.cache_key("What is the median purchase?")) is None
+    with pytest.raises(RuntimeError):
+        agent.export_query("What is the median purchase?")
@@ -0,0 +1,15 @@
+"""
+Tests for the bounded chat history
+"""
+from chat_history import ChatHistory
+
+
+def test_archived_answers_keep_their_markdown_headings():
+    history = ChatHistory(visible_messages=1, max_messages=10)
+    history.append('assistant', "## Top 10 Most Expensive Purchases:\n\n**1.** Item")
+    history.append('user', "Thanks")
+
+    markdown = history.archive_markdown()
+
+    assert "\n\n## Top 10 Most Expensive Purchases:" in markdown
+    assert markdown.startswith("🏛️ **Assistant:**\n\n")
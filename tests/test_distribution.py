@@ -0,0 +1,39 @@
+"""
+Tests for percentile / histogram answers that fall back to the exact query
+"""
+import pytest
+from config import EXPORT_CONFIG
+from ollama_agent import OllamaAgent
+
+
+@pytest.fixture
+def agent():
+    agent = OllamaAgent()
+    yield agent
+    agent.client.close()
+    agent.executor.shutdown(wait=False)
+
+
+def test_quarter_filter_uses_a_date_filtered_exact_query(agent, monkeypatch):
+    calls = []
+
+    def stream_query(pipeline, batch_size=None):
+        calls.append((pipeline, batch_size))
+        yield from ({'Total Price': price} for price in (10.0, 20.0, 30.0))
+
+    monkeypatch.setattr(agent, 'stream_query', stream_query)
+    query_info, pipeline = agent.plan_query("What was the median purchase in the first quarter?")
+
+    assert query_info['filters'] == {'quarter': 'Q1'}
+    assert {'$match': {'month_num': {'$in': [1, 2, 3]}}} in pipeline
+    assert agent.load_price_sketch(query_info['filters']) is None
+
+    rows = agent.run_query(query_info, pipeline)
+    assert rows == [{'percentile': 50, 'value': 20.0, 'count': 3, 'source': 'exact'}]
+    # Prices are read in large batches rather than the chat stream's small ones
+    assert calls[0][1] == EXPORT_CONFIG['chunk_size']
+
+
+def test_fiscal_quarter_filter_selects_its_months(agent):
+    assert agent.quarter_months('FQ1') == [7, 8, 9]
+    assert agent.quarter_months('Q4') == [10, 11, 12]
@@ -0,0 +1,38 @@
+"""
+Tests for chunked result exports
+"""
+import csv
+import io
+import os
+import time
+import pytest
+from exporter import export_chunks, write_export_file, remove_stale_exports
+
+
+def test_csv_header_covers_every_column_in_the_first_chunk():
+    docs = [{'a': 1}, {'a': 2, 'b': 'x'}, {'b': 'y', 'c': {'d': 3}}]
+
+    data = b''.join(export_chunks(iter(docs), 'csv', chunk_size=10)).decode('utf-8')
+
+    rows = list(csv.DictReader(io.StringIO(data)))
+    assert list(rows[0]) == ['a', 'b', 'c.d']
+    assert rows[2] == {'a': '', 'b': 'y', 'c.d': '3'}
+
+
+def test_csv_column_first_seen_in_a_later_chunk_fails_loudly():
+    docs = [{'a': 1}, {'a': 2, 'b': 'x'}]
+
+    with pytest.raises(ValueError):
+        b''.join(export_chunks(iter(docs), 'csv', chunk_size=1))
+
+
+def test_export_file_is_written_whole_and_stale_files_are_removed(tmp_path):
+    name = write_export_file(iter([b'a,b\n', b'1,2\n']), str(tmp_path), 'csv')
+    old = tmp_path / 'old.csv'
+    old.write_bytes(b'x')
+    os.utime(old, (time.time() - 7200, time.time() - 7200))
+
+    remove_stale_exports(str(tmp_path), 3600)
+
+    assert sorted(os.listdir(tmp_path)) == [name]
+    assert (tmp_path / name).read_bytes() == b'a,b\n1,2\n'
@@ -0,0 +1,64 @@
+"""
+Tests for keyword matching and the plan-cache key
+"""
+from intent_matcher import match_intent
+from ollama_agent import OllamaAgent
+
+IT_FILTER = {'$regex': 'Information Technology', '$options': 'i'}
+
+
+def test_it_department_needs_uppercase():
+    _, filters, _ = match_intent("Total spending for IT")
+    assert filters['Department Name'] == IT_FILTER
+
+    _, filters, _ = match_intent("total spending for it")
+    assert 'Department Name' not in filters
+
+
+def test_cache_key_keeps_it_distinct_from_the_pronoun():
+    agent = OllamaAgent()
+    try:
+        assert agent.cache_key("Total spending for IT?") != agent.cache_key("total spending for it")
+        assert agent.cache_key("  TOTAL   Spending for IT ") == agent.cache_key("total spending for IT?")
+
+        upper_info, _ = agent.plan_query("Total spending for IT")
+        lower_info, _ = agent.plan_query("total spending for it")
+        assert upper_info['filters'] == {'Department Name': IT_FILTER}
+        assert lower_info['filters'] == {}
+    finally:
+        agent.client.close()
+        agent.executor.shutdown(wait=False)
+
+
+def test_percentile_comes_from_words_next_to_percentile():
+    cases = {
+        "What was the median purchase in the 1st quarter?": 50,
+        "95th percentile purchase amount": 95,
+        "What is the 90 percentile price in the 2nd quarter?": 90,
+        "p99 purchase in 2013": 99,
+        "p50 purchase": 50,
+        "upper quartile of purchases": 75,
+    }
+    for question, percentile in cases.items():
+        query_type, _, parameters = match_intent(question)
+        assert query_type == 'percentile', question
+        assert parameters['percentile'] == percentile, question
+
+
+def test_questions_split_by_two_dimensions_become_breakdowns():
+    cases = {
+        "Spending by department, supplier and quarter": ['department', 'supplier', 'quarter'],
+        "Total spending by supplier and year": ['supplier', 'fiscal_year'],
+        "How many purchases by supplier and month?": ['supplier', 'month'],
+        "Acquisition methods by department and year": ['acquisition_method', 'department', 'fiscal_year'],
+        "Average purchase by department and quarter in 2014": ['department', 'quarter'],
+    }
+    for question, dimensions in cases.items():
+        query_type, _, parameters = match_intent(question)
+        assert query_type == 'cube', question
+        assert parameters == {'group_by': dimensions}, question
+
+
+def test_single_dimension_rankings_are_not_breakdowns():
+    assert match_intent("Top 5 suppliers by revenue")[0] == 'top_suppliers'
+    assert match_intent("Acquisition methods by number of orders")[0] == 'acquisition_methods'
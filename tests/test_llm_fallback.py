@@ -0,0 +1,127 @@
+"""
+Tests for the LLM fallback against a local /api/generate stub
+"""
+import socket
+import time
+import pytest
+import ollama_agent
+from ollama_agent import OllamaAgent
+
+# Questions the keyword rules don't recognize (same shape, different year)
+UNKNOWN_QUESTION = "Tell me something interesting about 2013"
+SAME_SHAPE_QUESTION = "Tell me something interesting about 2014"
+
+
+@pytest.fixture
+def agent(ollama_stub):
+    agent = OllamaAgent()
+    agent.ollama_url = ollama_stub.url
+    yield agent
+    agent.session.close()
+    agent.executor.shutdown(wait=False)
+    agent.client.close()
+
+
+def test_streamed_tokens_are_joined_and_parsed(agent, ollama_stub):
+    ollama_stub.reply(['{"query', '_type": "top_', 'suppliers"}'])
+
+    query_info = agent.understand_query(UNKNOWN_QUESTION)
+
+    assert query_info == {'query_type': 'top_suppliers', 'filters': {'Fiscal Year': '2013-2014'}}
+    assert ollama_stub.calls == 1
+    assert UNKNOWN_QUESTION in ollama_stub.prompts[0]
+
+
+def test_text_around_the_json_is_ignored(agent, ollama_stub):
+    ollama_stub.reply(['Sure! ', '{"query_type": ', '"count"}', ' Hope that helps.'])
+
+    assert agent.ask_ollama_for_query_type(UNKNOWN_QUESTION) == 'count'
+
+
+@pytest.mark.parametrize('tokens', [
+    ['{"query_type": "drop_database"}'],
+    ['{"query_type": ["sum"]}'],
+    ['["sum"]'],
+    ['{"query_type": "sum"'],
+    ['I would use sum'],
+    [],
+])
+def test_invalid_or_unknown_query_type_falls_back_to_list(agent, ollama_stub, tokens):
+    ollama_stub.reply(tokens)
+
+    query_info = agent.understand_query(UNKNOWN_QUESTION)
+
+    assert query_info['query_type'] == 'list'
+    # Rejected replies are not cached, so the next ask goes back to the LLM
+    agent.understand_query(UNKNOWN_QUESTION)
+    assert ollama_stub.calls == 2
+
+
+def test_read_timeout_falls_back_to_list(agent, ollama_stub, monkeypatch):
+    monkeypatch.setitem(ollama_agent.OLLAMA_CONFIG, 'read_timeout', 0.3)
+    ollama_stub.reply(['{"query_type": "sum"}'], first_byte_delay=1.5)
+
+    start = time.monotonic()
+    query_info = agent.understand_query(UNKNOWN_QUESTION)
+
+    assert query_info['query_type'] == 'list'
+    assert time.monotonic() - start < 1.2
+
+
+def test_slow_stream_is_cut_off_at_the_deadline(agent, ollama_stub, monkeypatch):
+    # Every chunk arrives within the read timeout, but the whole reply doesn't
+    monkeypatch.setitem(ollama_agent.OLLAMA_CONFIG, 'read_timeout', 0.5)
+    ollama_stub.reply(['{"query_type": ', '"sum"'] + [' '] * 20 + ['}'], chunk_delay=0.1)
+
+    start = time.monotonic()
+    query_info = agent.understand_query(UNKNOWN_QUESTION)
+
+    assert query_info['query_type'] == 'list'
+    assert time.monotonic() - start < 1.5
+
+
+def test_unreachable_server_falls_back_to_list(agent):
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    agent.ollama_url = f"http://127.0.0.1:{port}/api/generate"
+
+    assert agent.understand_query(UNKNOWN_QUESTION)['query_type'] == 'list'
+
+
+def test_one_http_call_per_question_shape(agent, ollama_stub):
+    ollama_stub.reply(['{"query_type": "trend_analysis"}'])
+
+    first_info, _ = agent.plan_query(UNKNOWN_QUESTION)
+    agent.plan_query(UNKNOWN_QUESTION)
+    agent.plan_query(UNKNOWN_QUESTION.upper() + "?")
+    second_info, _ = agent.plan_query(SAME_SHAPE_QUESTION)
+
+    assert ollama_stub.calls == 1
+    assert first_info['query_type'] == second_info['query_type'] == 'trend_analysis'
+    # The cached query type is shared, but filters still come from each question
+    assert first_info['filters'] == {'Fiscal Year': '2013-2014'}
+    assert second_info['filters'] == {'Fiscal Year': '2014-2015'}
+
+    agent.plan_query("Anything notable in 2012?")
+    assert ollama_stub.calls == 2
+
+
+def test_failed_classification_is_not_cached_by_plan_query(agent, ollama_stub, monkeypatch):
+    monkeypatch.setattr(agent, 'read_data_version', lambda: 1)
+    monkeypatch.setattr(agent, 'run_query', lambda query_info, pipeline: [{'Item Name': 'x', 'Total Price': 1.0}])
+    ollama_stub.reply(['not json'])
+
+    query_info, _ = agent.plan_query(UNKNOWN_QUESTION)
+    assert query_info['query_type'] == 'list'
+    agent.answer_question(UNKNOWN_QUESTION)
+    assert ollama_stub.calls == 2
+
+    # Once the model answers, the plan and the answer are cached as usual
+    ollama_stub.reply(['{"query_type": "count"}'])
+    monkeypatch.setattr(agent, 'run_query', lambda query_info, pipeline: [{'total': 3}])
+    assert agent.answer_question(UNKNOWN_QUESTION) == "**Total Number of Purchases:** 3"
+    query_info, _ = agent.plan_query(UNKNOWN_QUESTION)
+    agent.answer_question(UNKNOWN_QUESTION)
+    assert query_info['query_type'] == 'count'
+    assert ollama_stub.calls == 3
@@ -0,0 +1,248 @@
+"""
+Tests for fan-out aggregation across year partitions
+"""
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from ollama_agent import OllamaAgent
+from partitions import (
+    sorted_rows_plan, merge_sorted_partitions, apply_tail, get_path,
+    fan_out_aggregate, prune_partitions, split_pipeline
+)
+
+
+def evaluate(expr, doc):
+    """Evaluate the small subset of aggregation expressions the agent's pipelines use"""
+    if isinstance(expr, str) and expr.startswith('$'):
+        return get_path(doc, expr[1:])
+    if isinstance(expr, dict):
+        if '$cond' in expr:
+            condition, then, otherwise = expr['$cond']
+            return evaluate(then if evaluate(condition, doc) else otherwise, doc)
+        if '$isNumber' in expr:
+            value = evaluate(expr['$isNumber'], doc)
+            return isinstance(value, (int, float)) and not isinstance(value, bool)
+        return {key: evaluate(value, doc) for key, value in expr.items()}
+    return expr
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def accumulate(op, values):
+    numbers = [v for v in values if is_number(v)]
+    if op == '$sum':
+        return sum(numbers)
+    if op == '$avg':
+        return sum(numbers) / len(numbers) if numbers else None
+    present = [v for v in values if v is not None]
+    if not present:
+        return None
+    return max(present) if op == '$max' else min(present)
+
+
+def run_pipeline(docs, pipeline, collections):
+    """Run $match / $group / $count / $sort / $limit / $unionWith stages in Python"""
+    docs = [dict(doc) for doc in docs]
+    for stage in pipeline:
+        if '$match' in stage:
+            docs = [d for d in docs if all(d.get(k) == v for k, v in stage['$match'].items())]
+        elif '$unionWith' in stage:
+            docs += [dict(doc) for doc in collections[stage['$unionWith']['coll']].docs]
+        elif '$group' in stage:
+            groups = {}
+            for doc in docs:
+                key = evaluate(stage['$group']['_id'], doc)
+                groups.setdefault(repr(key), (key, []))[1].append(doc)
+            docs = []
+            for key, members in groups.values():
+                row = {'_id': key}
+                for field, expr in stage['$group'].items():
+                    if field != '_id':
+                        op, arg = next(iter(expr.items()))
+                        row[field] = accumulate(op, [evaluate(arg, doc) for doc in members])
+                docs.append(row)
+        elif '$count' in stage:
+            docs = [{stage['$count']: len(docs)}] if docs else []
+        else:
+            docs = apply_tail(docs, [stage])
+    return docs
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = iter(docs)
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.docs)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeCollection:
+    """Runs an aggregation pipeline in Python over a list of documents"""
+
+    def __init__(self, docs, name='purchases', collections=None):
+        self.docs = docs
+        self.name = name
+        self.collections = collections if collections is not None else {}
+        self.collections[name] = self
+        self.cursors = []
+
+    def aggregate(self, pipeline, **kwargs):
+        cursor = FakeCursor(run_pipeline(self.docs, pipeline, self.collections))
+        self.cursors.append(cursor)
+        return cursor
+
+
+PARTITIONS = [
+    [{'Item Name': 'a', 'Total Price': 5.0}, {'Item Name': 'b', 'Total Price': 900.0}],
+    [{'Item Name': 'c', 'Total Price': None}, {'Item Name': 'd', 'Total Price': 40.0}],
+    [{'Item Name': 'e', 'Total Price': 900.0}, {'Item Name': 'f', 'Total Price': 70.0}],
+]
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        yield executor
+
+
+@pytest.mark.parametrize('pipeline', [
+    [{'$sort': {'Total Price': -1}}],
+    [{'$sort': {'Total Price': -1}}, {'$limit': 3}],
+    [{'$sort': {'Total Price': 1, 'Item Name': -1}}],
+    [{'$limit': 4}],
+])
+def test_merge_matches_a_single_collection(executor, pipeline):
+    collections = [FakeCollection(docs) for docs in PARTITIONS]
+    plan = sorted_rows_plan(pipeline)
+
+    merged = list(merge_sorted_partitions(collections, pipeline, *plan, executor, 100))
+
+    expected = apply_tail([doc for docs in PARTITIONS for doc in docs], pipeline)
+    if '$sort' in pipeline[0]:
+        assert merged == expected
+    else:
+        assert len(merged) == len(expected)
+    assert all(c.cursors[0].closed for c in collections)
+
+
+def test_grouped_pipelines_are_not_merged_as_rows():
+    assert sorted_rows_plan([{'$group': {'_id': '$x', 'n': {'$sum': 1}}}, {'$sort': {'n': -1}}]) is None
+    assert sorted_rows_plan([{'$limit': 5}, {'$sort': {'x': 1}}]) is None
+    assert sorted_rows_plan([{'$match': {}}, {'$sort': {'x': 1}}]) == ({'x': 1}, None)
+
+
+PURCHASES = {
+    '2012-2013': [
+        {'Fiscal Year': '2012-2013', 'Department Name': 'Health', 'Total Price': 100.0},
+        {'Fiscal Year': '2012-2013', 'Department Name': 'Parks', 'Total Price': 30.0},
+        {'Fiscal Year': '2012-2013', 'Department Name': 'Health', 'Total Price': None},
+    ],
+    '2013-2014': [
+        {'Fiscal Year': '2013-2014', 'Department Name': 'Health', 'Total Price': 5.0},
+        {'Fiscal Year': '2013-2014', 'Department Name': 'Parks', 'Total Price': 900.0},
+        {'Fiscal Year': '2013-2014', 'Department Name': 'Parks', 'Total Price': 70.0},
+    ],
+    '2014-2015': [
+        {'Fiscal Year': '2014-2015', 'Department Name': 'Transit', 'Total Price': 45.5},
+    ],
+}
+
+
+@pytest.fixture
+def layouts():
+    """(single collection, fiscal year -> partition) holding the same purchases"""
+    single = FakeCollection([doc for docs in PURCHASES.values() for doc in docs])
+    registry = {}
+    partitions = {
+        fiscal_year: FakeCollection(docs, f"purchases_fy_{fiscal_year}", registry)
+        for fiscal_year, docs in PURCHASES.items()
+    }
+    return single, partitions
+
+
+def by_id(docs):
+    return sorted(docs, key=lambda doc: repr(doc.get('_id')))
+
+
+@pytest.mark.parametrize('query_info', [
+    {'query_type': 'sum', 'filters': {}},
+    {'query_type': 'average', 'filters': {}},
+    {'query_type': 'count', 'filters': {}},
+    {'query_type': 'trend_analysis', 'filters': {}},
+    {'query_type': 'comparison', 'filters': {}},
+    {'query_type': 'top_departments', 'filters': {}},
+    {'query_type': 'acquisition_methods', 'filters': {}},
+    {'query_type': 'count', 'filters': {'Department Name': 'Parks'}},
+])
+def test_fan_out_matches_a_single_collection(layouts, executor, query_info):
+    single, partitions = layouts
+    agent = OllamaAgent()
+    try:
+        pipeline = agent.generate_mongodb_query(query_info)
+    finally:
+        agent.client.close()
+        agent.executor.shutdown(wait=False)
+
+    expected = list(single.aggregate(pipeline))
+    merged = fan_out_aggregate(list(partitions.values()), pipeline, executor)
+
+    assert split_pipeline(pipeline) is not None
+    if any('$sort' in stage for stage in pipeline):
+        assert merged == pytest.approx(expected)
+    else:
+        assert by_id(merged) == pytest.approx(by_id(expected))
+
+
+def test_avg_is_merged_from_partial_sums_and_counts(layouts, executor):
+    _, partitions = layouts
+    pipeline = [{'$group': {'_id': '$Department Name', 'avg': {'$avg': '$Total Price'}, 'max': {'$max': '$Total Price'}}}]
+
+    kind, partial, _, accumulators = split_pipeline(pipeline)
+    assert kind == 'group'
+    assert set(partial[-1]['$group']) == {'_id', 'avg__sum', 'avg__count', 'max'}
+    assert accumulators == {'avg': '$avg', 'max': '$max'}
+
+    merged = {doc['_id']: doc for doc in fan_out_aggregate(list(partitions.values()), pipeline, executor)}
+    # The null price is left out of the Health average, as $avg does
+    assert merged['Health']['avg'] == pytest.approx(52.5)
+    assert merged['Parks']['avg'] == pytest.approx(1000.0 / 3)
+    assert merged['Parks']['max'] == 900.0
+    assert set(merged['Health']) == {'_id', 'avg', 'max'}
+
+
+def test_counts_are_summed_and_empty_partitions_ignored(layouts, executor):
+    _, partitions = layouts
+    pipeline = [{'$match': {'Department Name': 'Transit'}}, {'$count': 'total'}]
+
+    assert fan_out_aggregate(list(partitions.values()), pipeline, executor) == [{'total': 1}]
+    pipeline = [{'$match': {'Department Name': 'Nobody'}}, {'$count': 'total'}]
+    assert fan_out_aggregate(list(partitions.values()), pipeline, executor) == []
+
+
+def test_unmergeable_pipeline_falls_back_to_union(layouts, executor):
+    single, partitions = layouts
+    pipeline = [
+        {'$group': {'_id': '$Department Name', 'total': {'$sum': '$Total Price'}}},
+        {'$match': {'total': 975.0}},
+    ]
+
+    assert split_pipeline(pipeline) is None
+    assert fan_out_aggregate(list(partitions.values()), pipeline, executor) == list(single.aggregate(pipeline))
+
+
+def test_fiscal_year_match_prunes_partitions(layouts):
+    _, partitions = layouts
+
+    pruned = prune_partitions(partitions, [{'$match': {'Fiscal Year': '2013-2014'}}, {'$count': 'total'}])
+    assert [c.name for c in pruned] == ['purchases_fy_2013-2014']
+    assert prune_partitions(partitions, [{'$match': {'Fiscal Year': '2020-2021'}}]) == []
+    assert len(prune_partitions(partitions, [{'$match': {'Department Name': 'Parks'}}])) == 3
+    assert len(prune_partitions(partitions, [{'$count': 'total'}])) == 3
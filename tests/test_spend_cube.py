@@ -0,0 +1,27 @@
+"""
+Tests for spend cube quarter labels
+"""
+import pandas as pd
+from spend_cube import SpendCube
+from ollama_agent import OllamaAgent
+
+
+def test_fiscal_quarters_are_labelled_fq_and_calendar_filters_map_to_them():
+    df = pd.DataFrame({
+        'Creation Date': ['01/15/2014', '08/01/2013', '11/30/2013'],
+        'Fiscal Year': ['2013-2014'] * 3,
+        'Total Price': [10.0, 20.0, 40.0],
+    })
+    agent = OllamaAgent()
+    try:
+        agent.cube = SpendCube.build(df)
+
+        rows = agent.execute_cube_query({'group_by': ['quarter'], 'filters': {}}, [])
+        assert {row['quarter']: row['sum'] for row in rows} == {'FQ3': 10.0, 'FQ1': 20.0, 'FQ2': 40.0}
+
+        # "Q1" is a calendar quarter (Jan-Mar) everywhere in the agent
+        rows = agent.execute_cube_query({'group_by': ['quarter'], 'filters': {'quarter': 'Q1'}}, [])
+        assert [(row['quarter'], row['sum']) for row in rows] == [('FQ3', 10.0)]
+    finally:
+        agent.client.close()
+        agent.executor.shutdown(wait=False)